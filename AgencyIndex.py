@@ -0,0 +1,132 @@
+"""
+agency index for the report: resolves each agency code once and groups the grants by agency
+
+an agency code is the parent agency's code, optionally followed by a dash and the
+sub-agency's, e.g. HHS-NIH11 is the National Institutes of Health in the Department of Health
+and Human Services. Every distinct code is resolved once into an Agency:
+    code       : HHS-NIH11
+    parentCode : HHS
+    subCode    : NIH11
+    parent     : Department of Health and Human Services (the report's agency heading)
+    name       : the agency's own name from the extract, e.g. National Institutes of Health
+and shared by every grant with that code. Grants are grouped by parent agency as they're
+added. Within each parent, the report writers and rollup both group them by sub-agency name
+with bySubAgency, so several codes for the same sub-agency roll up into one group. Building
+the groups and the table of contents is linear in the number of grants.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+
+# dictionary of agencies using agency code as key
+# these were all the agencies in the search function for Grants.gov
+# I added 'N/A' to the list to make sure that if we did not have a match, we would still have a key for it
+agencyDictionary = {'USAID': 'Agency for International Development',
+                    'AC': 'AmeriCorps',
+                    'USDA': 'Department of Agriculture',
+                    'DOC': 'Department of Commerce',
+                    'DOE': 'Department of Energy',
+                    'DOD': 'Department of Defense',
+                    'ED': 'Department of Education',
+                    'PAMS': 'Department of Health and Human Services',
+                    'HHS': 'Department of Health and Human Services',
+                    'DHS': 'Department of Homeland Security',
+                    'HUD': 'Department of Housing and Urban Development',
+                    'USDOJ': 'Department of Justice',
+                    'DOL': 'Department of Labor',
+                    'DOS': 'Department of State',
+                    'DOI': 'Department of the Interior',
+                    'USDOT': 'Department of the Treasury',
+                    'DOT': 'Department of Transportation',
+                    'VA': 'Department of Veterans Affairs',
+                    'EPA': 'Environmental Protection Agency',
+                    'GCERC': 'Gulf Coast Ecosystem Restoration Council',
+                    'IMLS': 'Institute of Museum and Library Services',
+                    'MCC': 'Millennium Challenge Corportation',
+                    'NASA': 'National Aeronautics and Space Administration',
+                    'NARA': 'National Archives and Records Administration',
+                    'NEA': 'National Endowment for the Arts',
+                    'NEH': 'National Endowment for the Humanities',
+                    'NSF': 'National Science Foundation',
+                    'NRC': 'National Resource Conservation Council',
+                    'SBA': 'Small Business Administration',
+                    'SSA': 'Social Security Administration',
+                    'N/A': 'Other Agencies'}
+
+# agencies that aren't in agencyDictionary are listed under this
+OTHER_AGENCIES = 'Other Agencies'
+
+
+class Agency:
+
+    __slots__ = ('code', 'parentCode', 'subCode', 'parent', 'name')
+
+    def __init__(self, code, name='N/A'):
+        self.code = code
+        # agency codes have dashes to separate the information.
+        # the first part identifies the agency itself
+        self.parentCode, _, self.subCode = code.partition('-')
+        self.parent = agencyDictionary.get(self.parentCode, OTHER_AGENCIES)
+        self.name = name
+
+
+# groups the grants (or any items) of one parent agency by sub-agency name, in the order
+# each sub-agency first shows up
+def bySubAgency(grants, name=lambda grant: grant.agencyName):
+    groups = {}
+    for grant in grants:
+        groups.setdefault(name(grant), []).append(grant)
+    return groups
+
+
+class AgencyIndex:
+
+    def __init__(self):
+        # agency code -> Agency
+        self.agencies = {}
+        # parent agency name -> its items in the order they were added
+        self.grants = {}
+
+    # the Agency for the code, resolved the first time the code is seen
+    # name is the agency's own name from the extract (AgencyName)
+    def resolve(self, code, name='N/A'):
+        agency = self.agencies.get(code)
+        if agency is None:
+            code = sys.intern(code)
+            agency = Agency(code, sys.intern(name) if isinstance(name, str) else name)
+            self.agencies[code] = agency
+        return agency
+
+    # files the item (e.g. a Grant) under its agency, returns the Agency
+    def add(self, item, code, name='N/A'):
+        agency = self.resolve(code, name)
+        self.grants.setdefault(agency.parent, []).append(item)
+        return agency
+
+    # parent agency names, sorted, as listed in the table of contents
+    def agencyList(self):
+        return sorted(self.grants)
+
+    # parent agency name -> its items, what the report writers take as grantDictionary
+    def grantDictionary(self):
+        return self.grants
+
+    # (parent agency, sub-agency, number of items) for every sub-agency, grouped the way the
+    # report writers group them. name gives an item's sub-agency name (see bySubAgency)
+    def rollup(self, name=lambda grant: grant.agencyName):
+        return [(parent, subAgency, len(items))
+                for parent in self.agencyList()
+                for subAgency, items in bySubAgency(self.grants[parent], name).items()]
@@ -0,0 +1,302 @@
+"""
+keeps the cache/ directory to a size budget across several extracts
+creates file:
+    ./cache/manifest.json
+
+every file in the cache belongs to the extract it came from, e.g. for GrantsDBExtract20220203:
+    cache/GrantsDBExtract20220203v2.zip               downloaded extract
+    cache/extracted/GrantsDBExtract20220203v2.xml     unzipped extract
+    cache/parsed/GrantsDBExtract20220203v2.pickle     parsed snapshot (see GrantCache.py)
+and any other derived artifact that gets registered against it. The manifest records each
+extract's artifacts and when it was last used. When the cache holds more than MAX_EXTRACTS
+extracts, or more than MAX_BYTES on disk, the least recently used extracts are removed
+together with everything derived from them.
+
+with COMPRESSED on, extracts are only kept as their zip (the XML is parsed straight out of
+it) and snapshots are gzipped, which trades a little speed for a lot of disk.
+
+several report jobs can share the cache at once. Each extract has a lock file in
+cache/locks/, held while the extract is downloaded, unzipped, parsed or loaded, so a second
+job waits for the first one's download instead of repeating it, and eviction skips any
+extract another job is using. The manifest has its own lock for every read-modify-write.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import traceback
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# keep a week of extracts by default
+MAX_EXTRACTS = 7
+# and no more than 2 GB of them, set to None for no byte budget
+MAX_BYTES = 2 * 1024 ** 3
+# keep extracts zipped and snapshots gzipped
+COMPRESSED = False
+
+MANIFEST = "manifest.json"
+LOCK_DIR = "locks"
+# subdirectories of cache/ whose files are adopted by their extract's name
+# (cache/backfill/ is deliberately not one of them, backfilled extracts are kept for good)
+ARTIFACT_DIRS = ("", "extracted", "parsed")
+
+# cache file names start with the extract they belong to, e.g. GrantsDBExtract20220203v2.zip
+_extract_name = re.compile(r"^(GrantsDBExtract\d{8})v2\.")
+
+
+# returns the extract a cache file belongs to (e.g. GrantsDBExtract20220203), or None
+def extractName(path):
+    match = _extract_name.match(os.path.basename(path))
+    return match.group(1) if match else None
+
+
+# locks the open file f for this process, returns False if it's already locked and blocking is off
+def _lockFile(f, blocking):
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    # msvcrt only waits about 10 seconds for a lock, so keep retrying without it
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.1)
+
+
+def _unlockFile(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# exclusive lock on a lock file, shared by threads and processes alike
+# a thread can take a lock it already holds again (e.g. fetching an extract while loading it),
+# and the file stays locked until that thread has released it as often as it took it.
+# lock files are never deleted, removing one while another job waits on it would break the lock
+class FileLock:
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    # returns False if blocking is off and another thread or process holds the lock
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        if self.depth == 0:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            f = open(self.path, "a+b")
+            if not _lockFile(f, blocking):
+                f.close()
+                self.thread_lock.release()
+                return False
+            self.file = f
+        self.depth += 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            _unlockFile(self.file)
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# one FileLock per lock file in this process, so every thread waits on the same lock
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def fileLock(path):
+    path = os.path.abspath(path)
+    with _locks_guard:
+        if path not in _locks:
+            _locks[path] = FileLock(path)
+        return _locks[path]
+
+
+class CacheManager:
+
+    def __init__(self, cache_dir=None, max_extracts=MAX_EXTRACTS, max_bytes=MAX_BYTES,
+                 compressed=COMPRESSED):
+        self.cache_dir = cache_dir or os.path.join(os.getcwd(), "cache")
+        self.max_extracts = max_extracts
+        self.max_bytes = max_bytes
+        self.compressed = compressed
+
+    def _manifestPath(self):
+        return os.path.join(self.cache_dir, MANIFEST)
+
+    # held around every read-modify-write of the manifest
+    def _manifestLock(self):
+        return fileLock(os.path.join(self.cache_dir, LOCK_DIR, MANIFEST + ".lock"))
+
+    # lock held while an extract (or anything derived from it) is being written or read, e.g.
+    #   with cache.lock("GrantsDBExtract20220203"):
+    # other jobs wait for it, and eviction leaves a locked extract alone
+    def lock(self, extract):
+        return fileLock(os.path.join(self.cache_dir, LOCK_DIR, extract + ".lock"))
+
+    def _load(self):
+        try:
+            with open(self._manifestPath(), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, manifest):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._manifestPath() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self._manifestPath())
+
+    # path relative to cache/, so the manifest survives the program folder moving
+    def _relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.cache_dir)
+
+    # adds files that are in the cache but not in the manifest (e.g. from before there was
+    # a manifest) to the extract their name says they belong to
+    # partial files (.tmp, and the .part files of a download or unzip still in progress)
+    # aren't artifacts yet, so they're left out
+    def _adopt(self, manifest):
+        for subdir in ARTIFACT_DIRS:
+            directory = os.path.join(self.cache_dir, subdir)
+            if not os.path.isdir(directory):
+                continue
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
+                extract = extractName(filename)
+                if (extract is None or not os.path.isfile(path)
+                        or filename.endswith((".tmp", ".part"))):
+                    continue
+                entry = manifest.setdefault(
+                    extract, {"lastUsed": os.path.getmtime(path), "artifacts": []})
+                relative = self._relative(path)
+                if relative not in entry["artifacts"]:
+                    entry["artifacts"].append(relative)
+        return manifest
+
+    # records that the file at path is derived from extract, so they're evicted together
+    # and marks the extract as just used (loading a cached snapshot registers it too)
+    def register(self, extract, path):
+        with self._manifestLock():
+            manifest = self._load()
+            entry = manifest.setdefault(extract, {"lastUsed": time.time(), "artifacts": []})
+            relative = self._relative(path)
+            if relative not in entry["artifacts"]:
+                entry["artifacts"].append(relative)
+            entry["lastUsed"] = time.time()
+            self._save(manifest)
+
+    # bytes on disk used by the extract's artifacts
+    def _size(self, entry):
+        size = 0
+        for relative in entry["artifacts"]:
+            path = os.path.join(self.cache_dir, relative)
+            if os.path.isfile(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _delete(self, extract, entry):
+        for relative in entry["artifacts"]:
+            path = os.path.join(self.cache_dir, relative)
+            try:
+                if os.path.isfile(path):
+                    os.remove(path)
+            except Exception:
+                print("There was an exception while removing " + path)
+                traceback.print_exc()
+        print("removed {0} from the cache".format(extract))
+
+    # extracts in the cache, least recently used first
+    def extracts(self):
+        with self._manifestLock():
+            manifest = self._adopt(self._load())
+        return sorted(manifest, key=lambda extract: manifest[extract]["lastUsed"])
+
+    # deletes the extract's files unless another job holds its lock
+    # returns False if the extract is in use and was left alone
+    def _deleteUnlocked(self, extract, entry):
+        lock = self.lock(extract)
+        if not lock.acquire(blocking=False):
+            print("{0} is in use, leaving it in the cache".format(extract))
+            return False
+        try:
+            self._delete(extract, entry)
+        finally:
+            lock.release()
+        return True
+
+    # removes the extract and everything derived from it, unless it's in use
+    def remove(self, extract):
+        with self._manifestLock():
+            manifest = self._adopt(self._load())
+            entry = manifest.get(extract)
+            if entry is not None and self._deleteUnlocked(extract, entry):
+                del manifest[extract]
+                self._save(manifest)
+
+    # removes least recently used extracts until the cache is within MAX_EXTRACTS and
+    # MAX_BYTES. Extracts in keep (e.g. the one a report is using) and extracts another
+    # job has locked are never removed
+    def evict(self, keep=()):
+        with self._manifestLock():
+            manifest = self._adopt(self._load())
+            sizes = {extract: self._size(entry) for extract, entry in manifest.items()}
+            total = sum(sizes.values())
+            for extract in sorted(manifest, key=lambda extract: manifest[extract]["lastUsed"]):
+                over_count = self.max_extracts is not None and len(manifest) > self.max_extracts
+                over_bytes = self.max_bytes is not None and total > self.max_bytes
+                if not (over_count or over_bytes):
+                    break
+                if extract in keep or not self._deleteUnlocked(extract, manifest[extract]):
+                    continue
+                del manifest[extract]
+                total -= sizes[extract]
+            self._save(manifest)
+
+
+# the cache in the program's folder, shared by GrantDownloader and GrantCache
+cache = CacheManager()
@@ -0,0 +1,206 @@
+"""
+backfills past grants.gov extracts for trend data
+creates directory:
+    ./cache/backfill
+
+usage:
+    python GrantBackfill.py START END [--workers N] [--base URL]
+    e.g. python GrantBackfill.py 20220101 20220131
+
+downloads GrantsDBExtract<date>v2.zip for every date from START to END (YYYYMMDD, inclusive)
+through a pooled keep-alive session, several at a time. Every request waits on the shared
+GrantDownloader.crawlDelay, so requests still start at least a crawl-delay apart while the
+downloads themselves overlap. Each finished zip is handed to the parser straight away, so
+parsing runs while later downloads are still in progress.
+
+partial downloads are kept as .part files and resumed with a Range request on the next run.
+each date is locked while it's downloaded or parsed, so two backfills over overlapping
+ranges share the work instead of writing the same .part file.
+Dates without an extract (the site answers 404) are skipped. The zips and their parsed
+snapshots are kept in cache/backfill/, which the cache manager never evicts.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import datetime
+import os
+import traceback
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+
+import GrantCache
+import GrantDownloader
+from CacheManager import cache
+
+# where grants.gov publishes the extracts, see the FULL URL EXAMPLE in GrantDownloader.py
+DEFAULT_BASE = "https://www.grants.gov/extract/"
+DEFAULT_WORKERS = 4
+# give up on a file after this many failed attempts, it's picked up again on the next run
+MAX_ATTEMPTS = 5
+CHUNK_SIZE = 1 << 20
+
+
+# cache/backfill directory
+def backfillDir():
+    return os.path.join(GrantDownloader.cwd, "cache", "backfill")
+
+
+# filenames of the extracts between two YYYYMMDD dates inclusive, e.g. GrantsDBExtract20220203
+def extractNames(start, end):
+    day = datetime.datetime.strptime(start, "%Y%m%d").date()
+    last = datetime.datetime.strptime(end, "%Y%m%d").date()
+    names = []
+    while day <= last:
+        names.append("GrantsDBExtract" + day.strftime("%Y%m%d"))
+        day += datetime.timedelta(days=1)
+    return names
+
+
+class Backfill:
+
+    def __init__(self, start, end, base_url=DEFAULT_BASE, workers=DEFAULT_WORKERS,
+                 crawlDelay=GrantDownloader.crawlDelay):
+        self.filenames = extractNames(start, end)
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.workers = workers
+        self.crawlDelay = crawlDelay
+        self.directory = backfillDir()
+
+        # one keep-alive connection per worker, reused for every file it downloads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def zipPath(self, filename):
+        return os.path.join(self.directory, filename + "v2.zip")
+
+    def snapshotPath(self, filename):
+        return os.path.join(self.directory, filename + "v2.pickle")
+
+    # lock for a backfilled date, separate from the lock on the same extract in the main cache
+    def lock(self, filename):
+        return cache.lock(filename + "-backfill")
+
+    # downloads one extract, resuming a partial download if there is one
+    # returns the zip's path, or None if there is no extract for that date
+    def download(self, filename):
+        with self.lock(filename):
+            return self._download(filename)
+
+    def _download(self, filename):
+        zip_path = self.zipPath(filename)
+        if os.path.isfile(zip_path):
+            return zip_path
+        part_path = zip_path + ".part"
+        url = self.base_url + filename + "v2.zip"
+
+        for attempt in range(MAX_ATTEMPTS):
+            have = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+            headers = {"Range": "bytes={0}-".format(have)} if have else {}
+            self.crawlDelay.wait()
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=60) as response:
+                    status = response.status_code
+                    if status == 404:
+                        print("no extract for " + filename)
+                        return None
+                    # 206 continues the .part, 200 means the server sent the whole file
+                    if status in (200, 206):
+                        with open(part_path, "ab" if status == 206 else "wb") as f:
+                            for chunk in response.iter_content(CHUNK_SIZE):
+                                f.write(chunk)
+                    # 416 means there's nothing past the end of the .part, checked below
+                    elif status != 416:
+                        print("status code is {0} for {1}, retrying".format(status, filename))
+                        continue
+            # sometimes the site drops the connection, the .part is resumed on the next attempt
+            except (ChunkedEncodingError, ConnectionError, Timeout):
+                print("connection dropped while downloading {0}, resuming".format(filename))
+                continue
+
+            if zipfile.is_zipfile(part_path):
+                os.replace(part_path, zip_path)
+                print("downloaded " + filename)
+                return zip_path
+            # a complete download that isn't a zip can't be resumed, start over
+            if os.path.isfile(part_path):
+                os.remove(part_path)
+
+        print("giving up on {0} after {1} attempts".format(filename, MAX_ATTEMPTS))
+        return None
+
+    # parses a downloaded extract into its snapshot, unless that's already been done
+    def parse(self, zip_path):
+        filename = os.path.basename(zip_path).split("v2.zip")[0]
+        snapshot_path = self.snapshotPath(filename)
+        with self.lock(filename):
+            if not os.path.isfile(snapshot_path):
+                GrantCache.buildFromZip(zip_path, snapshot_path)
+                print("parsed " + filename)
+        return snapshot_path
+
+    # downloads every extract in the date range, parsing each one as soon as it's downloaded
+    # returns the paths of the parsed snapshots in date order
+    def run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        snapshots = {}
+        # parsing is CPU-bound and threads share the GIL, so a single parser thread is used
+        with ThreadPoolExecutor(self.workers) as downloads, ThreadPoolExecutor(1) as parsing:
+            pending = {downloads.submit(self.download, filename): filename
+                       for filename in self.filenames}
+            parsed = {}
+            for future in as_completed(pending):
+                try:
+                    zip_path = future.result()
+                except Exception:
+                    print("There was an exception while downloading " + pending[future])
+                    traceback.print_exc()
+                    continue
+                if zip_path is not None:
+                    parsed[parsing.submit(self.parse, zip_path)] = pending[future]
+            for future, filename in parsed.items():
+                try:
+                    snapshots[filename] = future.result()
+                except Exception:
+                    print("There was an exception while parsing " + filename)
+                    traceback.print_exc()
+        self.session.close()
+        return [snapshots[filename] for filename in self.filenames if filename in snapshots]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Download and parse past grants.gov extracts.")
+    parser.add_argument("start", help="first extract date, YYYYMMDD")
+    parser.add_argument("end", help="last extract date, YYYYMMDD")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="downloads to run at once (default: %(default)s)")
+    parser.add_argument("--base", default=DEFAULT_BASE,
+                        help="URL the extracts are published under (default: %(default)s)")
+    args = parser.parse_args()
+
+    backfill = Backfill(args.start, args.end, args.base, args.workers)
+    try:
+        paths = backfill.run()
+    except KeyboardInterrupt:
+        # finished files are kept, and any .part files are resumed next time
+        paths = []
+    print("{0} extracts backfilled into {1}".format(len(paths), backfill.directory))
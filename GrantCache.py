@@ -0,0 +1,239 @@
+"""
+parsed cache of a grants.gov XML extract
+creates directory:
+    ./cache/parsed
+
+parsing the full XML extract is the slow part of every report, so each extract is parsed
+once into a snapshot and pickled next to the rest of the cache. A snapshot holds every
+opportunity as a dictionary of its fields (tag name without the namespace -> text), sorted
+by post date, plus a post date index so a date range is found with a binary search instead
+of checking every opportunity, and facet indexes (see GrantFacets.py) so filters on
+eligibility, category, funding instrument and CFDA number are bitwise intersections.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import gzip
+import os
+import pickle
+import sys
+import xml.etree.ElementTree as et
+import zipfile
+from bisect import bisect_left, bisect_right
+
+import GrantDownloader
+from CacheManager import cache
+from GrantFacets import FACET_FIELDS, FacetIndex, positionsOf, rangeBitset
+
+# bump this whenever the snapshot layout changes so old pickles get rebuilt
+SNAPSHOT_VERSION = 3
+
+
+# cache/parsed directory
+def parsedDir():
+    return os.path.join(GrantDownloader.cwd, "cache", "parsed")
+
+
+# the extract's filename, formatted like GrantsDBExtract20220203
+# takes the extract's XML or zip path, or the filename itself
+def extractFilename(extract):
+    return os.path.basename(extract).split("v2.")[0]
+
+
+# full filepath of the snapshot for an extract, gzipped if the cache is compressed
+# takes the extract's XML or zip path, or a filename formatted like GrantsDBExtract20220203
+def snapshotPath(extract, compressed=None):
+    if compressed is None:
+        compressed = cache.compressed
+    extension = "v2.pickle.gz" if compressed else "v2.pickle"
+    return os.path.join(parsedDir(), extractFilename(extract) + extension)
+
+
+# opens a snapshot file, gzipped if the snapshot's name ends in .gz
+def _open(path, mode, name=None):
+    if (name or path).endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+# convert MMDDYYYY into YYYYMMDD so that dates compare as strings, same as dateHierarchyForm
+# opportunities without a post date get 'N/A', which sorts after every date
+def postKey(postDate):
+    if not isinstance(postDate, str) or postDate == 'N/A':
+        return 'N/A'
+    return postDate[4:] + postDate[:4]
+
+
+# reads every opportunity out of the extract without building the whole tree in memory
+# source is the extract's path or an open (binary) file
+# facet fields (see GrantFacets.py) keep every occurrence, as a tuple of values
+def parseExtract(source):
+    records = []
+    depth = 0
+    for event, elem in et.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        # depth 1 is an opportunity (children of the <Grants> root)
+        if depth == 1:
+            record = {}
+            for field in elem:
+                tag = sys.intern(field.tag.rsplit('}', 1)[-1])
+                if tag in FACET_FIELDS:
+                    if field.text:
+                        record[tag] = record.get(tag, ()) + (sys.intern(field.text.strip()),)
+                # same as opportunity.find(), only the first occurrence of a field is kept
+                elif tag not in record:
+                    record[tag] = field.text
+            records.append(record)
+            elem.clear()
+    return records
+
+
+class Snapshot:
+
+    # records are sorted by post date unless their postKeys are passed in (already sorted)
+    # the facet index is built unless it's passed in too
+    def __init__(self, source, records, postKeys=None, facets=None):
+        self.source = source
+        if postKeys is None:
+            records = sorted(records, key=lambda r: postKey(r.get('PostDate', 'N/A')))
+            postKeys = [postKey(r.get('PostDate', 'N/A')) for r in records]
+        self.records = records
+        self.postKeys = postKeys
+        self.facets = facets if facets is not None else FacetIndex(records)
+
+    # (lo, hi) slice of the records posted between start and end inclusive, both YYYYMMDD
+    def span(self, start, end):
+        return bisect_left(self.postKeys, start), bisect_right(self.postKeys, end)
+
+    # opportunities posted between start and end inclusive, both formatted YYYYMMDD
+    def postedBetween(self, start, end):
+        lo, hi = self.span(start, end)
+        return self.records[lo:hi]
+
+    # bitset of the opportunities posted between start and end that match the facet filters
+    # (see FacetIndex.match), bit i is records[i]
+    def match(self, start, end, filters):
+        return self.facets.match(filters, rangeBitset(*self.span(start, end)))
+
+    # opportunities posted between start and end inclusive that match the facet filters,
+    # in post date order. With no filters this is the same as postedBetween
+    def filtered(self, start, end, filters=None):
+        if not filters or not any(filters.values()):
+            return self.postedBetween(start, end)
+        return [self.records[i] for i in positionsOf(self.match(start, end, filters))]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        # the version is pickled on its own ahead of the snapshot, so it can be checked
+        # without loading the rest
+        with _open(tmp_path, "wb", path) as f:
+            pickle.dump(SNAPSHOT_VERSION, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump((self.source, self.records, self.postKeys, self.facets),
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with _open(path, "rb") as f:
+            if pickle.load(f) != SNAPSHOT_VERSION:
+                return None
+            source, records, postKeys, facets = pickle.load(f)
+        return cls(source, records, postKeys, facets)
+
+
+# the SNAPSHOT_VERSION a snapshot file was saved with, or None if it can't be read
+# snapshots from before the version was stored separately come back as a tuple, which never
+# matches
+def storedVersion(path):
+    try:
+        with _open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+# parses the extract (XML or zip) and saves its snapshot, even if one already exists
+def build(extract_path):
+    if extract_path.endswith(".zip"):
+        return buildFromZip(extract_path)
+    snapshot = Snapshot(os.path.basename(extract_path), parseExtract(extract_path))
+    snapshot.save(snapshotPath(extract_path))
+    return snapshot
+
+
+# parses the extract straight out of its zip, without extracting it first, and saves its
+# snapshot to path (the usual cache/parsed/ location by default)
+def buildFromZip(zip_path, path=None):
+    with zipfile.ZipFile(zip_path, 'r') as data:
+        xml_name = [name for name in data.namelist() if name.endswith(".xml")][0]
+        with data.open(xml_name) as f:
+            snapshot = Snapshot(xml_name, parseExtract(f))
+    snapshot.save(path or snapshotPath(xml_name))
+    return snapshot
+
+
+# returns the snapshot for the extract (XML or zip path), loading it from the cache if
+# it's there and parsing (then caching) the extract if it isn't
+# the snapshot is registered with the cache manager so it's evicted along with its extract
+# the extract's lock is held throughout, so concurrent jobs parse it once and share the result
+def snapshot(extract_path):
+    filename = extractFilename(extract_path)
+    with cache.lock(filename):
+        return _snapshot(extract_path, filename)
+
+
+def _snapshot(extract_path, filename):
+    for path in (snapshotPath(filename), snapshotPath(filename, not cache.compressed)):
+        if os.path.isfile(path):
+            try:
+                cached = Snapshot.load(path)
+            except Exception:
+                print("could not read cached snapshot " + path + ", rebuilding")
+                cached = None
+            if cached is not None:
+                cache.register(filename, path)
+                return cached
+    built = build(extract_path)
+    cache.register(filename, snapshotPath(filename))
+    return built
+
+
+# downloads the extract if it isn't cached and returns its snapshot
+# the extract stays locked from the download until the snapshot is loaded, so another job
+# can't evict it in between
+def fetch(grant_url, filename):
+    with cache.lock(filename):
+        return snapshot(GrantDownloader.fetchExtract(grant_url, filename))
+
+
+# returns the snapshot of the latest extract on the XML dump page, same as
+# snapshot(GrantDownloader.get(xml_dumps_url)) but safe to run alongside other jobs
+def latest(xml_dumps_url):
+    print("getting latest XML dump")
+    grant_url, filename = GrantDownloader.latestExtract(xml_dumps_url)
+    print("today's file grabbed ({0}), checking...".format(filename), end="")
+    return fetch(grant_url, filename)
+
+
+# True if the extract (filename formatted like GrantsDBExtract20220203) already has a snapshot
+# saved with the current SNAPSHOT_VERSION. A snapshot from an older version would only be
+# rebuilt by the next report, so it doesn't count
+def isWarm(filename):
+    return any(os.path.isfile(path) and storedVersion(path) == SNAPSHOT_VERSION
+               for path in (snapshotPath(filename), snapshotPath(filename, not cache.compressed)))
@@ -21,18 +21,24 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import glob
 import os
+import shutil
 import sys
+import threading
 import traceback
 import zipfile
 from http.client import RemoteDisconnected
-from time import sleep
+from time import monotonic, sleep
+from urllib.parse import urljoin
 
 import requests
 import wget
 from bs4 import BeautifulSoup as bs
 from requests.exceptions import ConnectionError
 
+from CacheManager import cache
+
 """
 
 """
@@ -42,85 +48,117 @@ from requests.exceptions import ConnectionError
 cwd = os.getcwd()
 
 
-# cleans temporary (*.tmp) files in case of program halt or error
+# downloads and unzips are written next to where they're going, to a name only this process
+# uses, then renamed into place once they're complete. Other jobs never see a half-written
+# file, and never have their files cleaned up by this one
+def partialPath(path):
+    return "{0}.{1}.part".format(path, os.getpid())
+
+
+# cleans this process's partial (*.part) and wget temporary (*.tmp) files in case of program
+# halt or error. Other jobs' partial files are left alone
 def cleanTmp():
-    try:
-        for filename in os.listdir(cwd):
-            f = os.path.join(cwd, filename)
-            if os.path.isfile(f):
-                if f.endswith(".tmp"):
+    tag = ".{0}.part".format(os.getpid())
+    for directory in (os.path.join(cwd, "cache"), os.path.join(cwd, "cache", "extracted")):
+        try:
+            for f in glob.glob(os.path.join(directory, "*" + tag + "*")):
+                if os.path.isfile(f):
                     os.remove(f)
-    except Exception:
-        print("There was an exception while cleaning temp files in " + cwd)
-        print(traceback.print_stack())
+        except Exception:
+            print("There was an exception while cleaning temp files in " + directory)
+            print(traceback.print_stack())
 
 
-# cleans old zip and XML files in cache if there is a new one
+# removes partial files any job left behind for the extract
+# only safe while holding the extract's lock, since then nobody else is writing them
+def cleanPartials(filename):
+    for directory in (os.path.join(cwd, "cache"), os.path.join(cwd, "cache", "extracted")):
+        for f in glob.glob(os.path.join(directory, filename + "v2.*.part*")):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+
+# removes every extract but the current one from the cache, along with everything derived from them
+# (normally the cache keeps several extracts and evicts the least recently used, see CacheManager.py)
 # takes the input of the current grant file name. it should be formatted like this:
 #   GrantsDBExtract20220203
 # as is with the rest of the script.
 def cleanOldCache(currentfilename):
-    # cache directory
-    cache_dir = os.path.join(cwd, "cache")
-    # cache/extracted directory
-    xml_dir = os.path.join(cache_dir, "extracted")
-    # full filepath for the current cached .zip file
-    current_zip = os.path.join(cache_dir, currentfilename + "v2.zip")
-    # full filepath for the current cached .xml file
-    current_xml = os.path.join(xml_dir, currentfilename + "v2.xml")
     try:
-        for filename in os.listdir(cache_dir):
-            f = os.path.join(cache_dir, filename)
-            if os.path.isfile(f):
-                # if the .zip is the latest one do not remove
-                if f == current_zip:
-                    continue
-                # otherwise remove if .zip
-                else:
-                    os.remove(f)
-        for filename in os.listdir(xml_dir):
-            f = os.path.join(xml_dir, filename)
-            if os.path.isfile(f):
-                # if the .xml is the latest one do not remove
-                if f == current_xml:
-                    continue
-                # otherwise remove
-                else:
-                    os.remove(f)
+        for extract in cache.extracts():
+            if extract != currentfilename:
+                cache.remove(extract)
     except Exception as e:
-        print("There was an exception while cleaning old cache files in " + cache_dir)
+        print("There was an exception while cleaning old cache files in " + cache.cache_dir)
         print(traceback.print_stack())
 
 
 # unzips the file into cache/extracted
 # used in multiple places, so it's implemented as a function to save time
+# each file is renamed into place once it's fully written, so a cut-off unzip never
+# leaves a truncated XML behind
 def unzip_xml(file_path):
+    extract_dir = os.path.join(cwd, "cache", "extracted")
     with zipfile.ZipFile(file_path, 'r') as data:
-        data.extractall(os.path.join(cwd, "cache", "extracted"))
+        for name in data.namelist():
+            if name.endswith("/"):
+                continue
+            path = os.path.join(extract_dir, os.path.basename(name))
+            part_path = partialPath(path)
+            with data.open(name) as source, open(part_path, "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.replace(part_path, path)
 
 
-# driver function using beautifulsoup4 web scraping library
-def get(xml_dumps_url):
-    #################################################
-    ## Cache directory creation/existence checking ##
-    #################################################
+# grants.gov asks crawlers to wait between requests
+# 10 seconds is defined in https://www.grants.gov/robots.txt
+# but really, 15 seconds is more reliable
+CRAWL_DELAY = 15
+
+
+# spaces out requests to grants.gov so that there are at least `delay` seconds between them
+# shared between threads, so background jobs (see GrantWatcher.py) stay polite together
+class CrawlDelay:
+
+    def __init__(self, delay=CRAWL_DELAY):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.last = None
+
+    # blocks until it's polite to make the next request
+    def wait(self):
+        with self.lock:
+            if self.last is not None:
+                pause = self.last + self.delay - monotonic()
+                if pause > 0:
+                    sleep(pause)
+            self.last = monotonic()
+
+
+crawlDelay = CrawlDelay()
+
+
+# creates cache/ and cache/extracted/ if they don't exist
+def makeCacheDirs():
     # cache_dir
     cache_dir = os.path.join(cwd, "cache")
-    extract_dir = os.path.join(cwd, "cache", "extracted")
     # extract_dir
+    extract_dir = os.path.join(cwd, "cache", "extracted")
     # if cache folder does not exist, make it
     if not os.path.isdir(cache_dir):
         print("creating cache directory")
-        os.mkdir(cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
     # if extracted folder does not exist, make it
     if not os.path.isdir(extract_dir):
         print("creating extracted directory")
-        os.mkdir(extract_dir)
+        os.makedirs(extract_dir, exist_ok=True)
 
-    ######################################################################
-    ## Use bs4 to grab the latest filename straight from the website :) ##
-    ######################################################################
-    print("getting latest XML dump")
+
+# gets the URL and filename of the latest extract from the XML dump page
+# the filename is formatted like GrantsDBExtract20220203, as is with the rest of the script
+def latestExtract(xml_dumps_url):
     # grab the XML dump page
     xml_dumps_page = requests.get(xml_dumps_url)
     # make sure it's successful
@@ -130,11 +168,9 @@ def get(xml_dumps_url):
         if status == 200:
             successful = True
         else:
-            # 10 seconds is defined in https://www.grants.gov/robots.txt
-            # but really, 15 seconds is more reliable
             print(
-                "status code is {0}, waiting 15 seconds to retry...".format(status))
-            sleep(15)
+                "status code is {0}, waiting {1} seconds to retry...".format(status, CRAWL_DELAY))
+            sleep(CRAWL_DELAY)
             xml_dumps_page = requests.get(xml_dumps_url)
     # web page
     soup = bs(xml_dumps_page.content, 'html.parser')
@@ -143,13 +179,37 @@ def get(xml_dumps_url):
     # find all <a> tags which has href="", since that's where the links are stored
     xml_hrefs = xml_link_entries.find_all('a', href=True)
     # get just the last href since that's the latest one
-    grant_url = xml_hrefs[len(xml_hrefs)-1]['href']
+    # (relative links are resolved against the dump page)
+    grant_url = urljoin(xml_dumps_url, xml_hrefs[len(xml_hrefs)-1]['href'])
     # split URL at "/"
     split_url = grant_url.split("/")
     # remove v2.zip from the end because i cba to change later code
     filename = split_url[len(split_url)-1].split("v2.zip")[0]
+    return grant_url, filename
 
-    print("today's file grabbed ({0}), checking...".format(filename), end="")
+
+# records the extract's files with the cache manager and makes room for it by evicting
+# the least recently used extracts. returns the path the extract should be read from
+def cacheExtract(filename, path):
+    cache.register(filename, path)
+    cache.evict(keep={filename})
+    return path
+
+
+# makes sure the given extract is in the cache, downloading and unzipping it if needed
+# returns the FULL filepath of the XML file, or of the zip file if the cache is compressed
+# (GrantCache reads either)
+# holds the extract's lock throughout, so when several jobs want the same extract one of
+# them downloads it and the rest wait, then use that download
+def fetchExtract(grant_url, filename):
+    with cache.lock(filename):
+        return _fetchExtract(grant_url, filename)
+
+
+def _fetchExtract(grant_url, filename):
+    makeCacheDirs()
+    cache_dir = os.path.join(cwd, "cache")
+    extract_dir = os.path.join(cwd, "cache", "extracted")
 
     ######################################################
     ## Check if XML or zip files already exist in cache ##
@@ -157,40 +217,46 @@ def get(xml_dumps_url):
     # test if XML file exists first to avoid re-downloading zip if unnecessary
     xml_path = os.path.join(extract_dir, filename + "v2.xml")
     zip_path = os.path.join(cache_dir, filename + "v2.zip")
-    if os.path.isfile(xml_path):
+    # (a compressed cache prefers the zip, but uses the XML if that's all there is)
+    if os.path.isfile(xml_path) and not (cache.compressed and os.path.isfile(zip_path)):
         print("XML file exists")
-        return xml_path
+        return cacheExtract(filename, xml_path)
     # test if zip file exists
     if os.path.isfile(zip_path):
+        if cache.compressed:
+            print("zip file exists")
+            return cacheExtract(filename, zip_path)
         print("zip file exists, unzipping...", end="")
         unzip_xml(zip_path)
         print("done")
-        return xml_path
+        cache.register(filename, zip_path)
+        return cacheExtract(filename, xml_path)
     print("does not exist\ndownloading...")
+    # anything partial for this extract is from a job that was cut off
+    cleanPartials(filename)
 
     ########################################################
     ## Download zip file, if necessary according to above ##
     ########################################################
-    # download
+    # download to a partial file first, it's renamed to zip_path once it's complete
+    part_path = partialPath(zip_path)
     successful = False
     while not successful:
         try:
-            # clean up old zip files
-            cleanOldCache(filename)
-            wget.download(grant_url, cache_dir)
+            wget.download(grant_url, part_path)
             successful = True
         # sometimes the site prevents connection due to crawl-delay
         except ConnectionError:
-            print("connection aborted, waiting 15 seconds...")
-            sleep(15)
+            print("connection aborted, waiting {0} seconds...".format(CRAWL_DELAY))
+            sleep(CRAWL_DELAY)
         # ... and sometimes the site disconnects before wget wants it to...
         # the file should still be downloaded just fine
         # (manually checked sha1 checksum vs. normally downloaded file and it checked out)
         except RemoteDisconnected:
             print("remote disconnected, verifying if file exists...")
-            # if the zip file exists, then wget downloaded it
+            # if the partial file exists, then wget downloaded it
             # otherwise it stays as a .tmp file
-            if os.path.isfile(zip_path):
+            if os.path.isfile(part_path):
                 successful = True
                 print("file exists, continuing")
             else:
@@ -200,10 +266,33 @@ def get(xml_dumps_url):
         except KeyboardInterrupt:
             cleanTmp()
             sys.exit(0)
+        # a download that isn't a whole zip is started over
+        if successful and not zipfile.is_zipfile(part_path):
+            print("\ndownloaded file is not a complete zip, attempting re-download")
+            cleanTmp()
+            successful = False
+    os.replace(part_path, zip_path)
 
     ########################################
     ## Unzip and return the FULL filepath ##
     ########################################
+    # a compressed cache keeps only the zip
+    if cache.compressed:
+        print()
+        return cacheExtract(filename, zip_path)
     print("\nunzipping")
     unzip_xml(zip_path)
-    return xml_path
+    cache.register(filename, zip_path)
+    return cacheExtract(filename, xml_path)
+
+
+# driver function using beautifulsoup4 web scraping library
+def get(xml_dumps_url):
+    ######################################################################
+    ## Use bs4 to grab the latest filename straight from the website :) ##
+    ######################################################################
+    print("getting latest XML dump")
+    grant_url, filename = latestExtract(xml_dumps_url)
+
+    print("today's file grabbed ({0}), checking...".format(filename), end="")
+    return fetchExtract(grant_url, filename)
@@ -0,0 +1,172 @@
+"""
+facet indexes over a snapshot's opportunities, for filtering by the enumerated extract fields
+    EligibleApplicants        : who can apply, e.g. 00 (State governments)
+    CategoryOfFundingActivity : e.g. ED (Education)
+    FundingInstrumentType     : e.g. G (Grant)
+    CFDANumbers               : assistance listing numbers, e.g. 93.243
+an opportunity can have several values for each of them.
+
+for every value of every facet, the index holds a bitmap of the opportunities that have it
+(bit i is the snapshot's i-th record). A value most opportunities share is kept as an int
+bitset, a rare value as an array of record positions, which is turned into a bitset when it
+is queried. A filter is then a few bitwise ORs (any of a facet's values) and ANDs (every
+facet, and the post date range).
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from array import array
+
+# fields that can repeat in an opportunity and are indexed as facets
+FACET_FIELDS = ('EligibleApplicants', 'CategoryOfFundingActivity', 'FundingInstrumentType',
+                'CFDANumbers')
+
+# names for the codes grants.gov uses, CFDA numbers have no names
+# these are the values in the search function for Grants.gov
+eligibilityDictionary = {'00': 'State governments',
+                         '01': 'County governments',
+                         '02': 'City or township governments',
+                         '04': 'Special district governments',
+                         '05': 'Independent school districts',
+                         '06': 'Public and State controlled institutions of higher education',
+                         '07': 'Native American tribal governments (Federally recognized)',
+                         '08': 'Public housing authorities/Indian housing authorities',
+                         '11': 'Native American tribal organizations (other than Federally recognized tribal governments)',
+                         '12': 'Nonprofits having a 501(c)(3) status with the IRS, other than institutions of higher education',
+                         '13': 'Nonprofits that do not have a 501(c)(3) status with the IRS, other than institutions of higher education',
+                         '20': 'Private institutions of higher education',
+                         '21': 'Individuals',
+                         '22': 'For profit organizations other than small businesses',
+                         '23': 'Small businesses',
+                         '25': 'Others',
+                         '99': 'Unrestricted'}
+
+categoryDictionary = {'ACA': 'Affordable Care Act',
+                      'AG': 'Agriculture',
+                      'AR': 'Arts',
+                      'BC': 'Business and Commerce',
+                      'CD': 'Community Development',
+                      'CP': 'Consumer Protection',
+                      'DPR': 'Disaster Prevention and Relief',
+                      'ED': 'Education',
+                      'ELT': 'Employment, Labor and Training',
+                      'EN': 'Energy',
+                      'ENV': 'Environment',
+                      'FN': 'Food and Nutrition',
+                      'HL': 'Health',
+                      'HO': 'Housing',
+                      'HU': 'Humanities',
+                      'IIJ': 'Infrastructure Investment and Jobs Act',
+                      'IS': 'Information and Statistics',
+                      'ISS': 'Income Security and Social Services',
+                      'LJL': 'Law, Justice and Legal Services',
+                      'NR': 'Natural Resources',
+                      'O': 'Other',
+                      'OZ': 'Opportunity Zone Benefits',
+                      'RA': 'Recovery Act',
+                      'RD': 'Regional Development',
+                      'ST': 'Science and Technology and other Research and Development',
+                      'T': 'Transportation'}
+
+instrumentDictionary = {'CA': 'Cooperative Agreement',
+                        'G': 'Grant',
+                        'O': 'Other',
+                        'PC': 'Procurement Contract'}
+
+# facet field -> its code names
+facetLabels = {'EligibleApplicants': eligibilityDictionary,
+               'CategoryOfFundingActivity': categoryDictionary,
+               'FundingInstrumentType': instrumentDictionary,
+               'CFDANumbers': {}}
+
+
+# bitset with the given bits set
+def bitsetFromPositions(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for i in positions:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
+# positions of the set bits, lowest first
+def positionsOf(bitset):
+    # least significant bit first
+    bits = bin(bitset)[:1:-1]
+    i = bits.find('1')
+    while i != -1:
+        yield i
+        i = bits.find('1', i + 1)
+
+
+# bitset of every position from lo up to (not including) hi
+def rangeBitset(lo, hi):
+    return ((1 << hi) - 1) ^ ((1 << lo) - 1)
+
+
+class FacetIndex:
+
+    # builds the index over records, in the order they're kept in (bit i is records[i])
+    def __init__(self, records):
+        self.size = len(records)
+        positions = {field: {} for field in FACET_FIELDS}
+        for i, record in enumerate(records):
+            for field in FACET_FIELDS:
+                for value in record.get(field, ()):
+                    positions[field].setdefault(value, []).append(i)
+        # a position array takes 4 bytes per opportunity and a bitset 1 bit per record,
+        # so values on fewer than 1 in 32 records are cheaper as arrays
+        dense = max(self.size // 32, 1)
+        self.facets = {}
+        for field, values in positions.items():
+            self.facets[field] = {
+                value: (bitsetFromPositions(found, self.size) if len(found) >= dense
+                        else array('I', found))
+                for value, found in values.items()}
+
+    # bitset of the records with the value
+    def bitset(self, field, value):
+        entry = self.facets[field].get(value, 0)
+        if isinstance(entry, array):
+            return bitsetFromPositions(entry, self.size)
+        return entry
+
+    # number of records with the value
+    def count(self, field, value):
+        entry = self.facets[field].get(value, 0)
+        if isinstance(entry, array):
+            return len(entry)
+        return bin(entry).count('1')
+
+    # values of the facet found in the records, sorted
+    def values(self, field):
+        return sorted(self.facets[field])
+
+    # bitset of the records matching every facet in filters, and any of its values
+    # filters maps a facet field to the values wanted, e.g.
+    #   {'EligibleApplicants': ['00'], 'CategoryOfFundingActivity': ['ED']}
+    # a field with no values wanted doesn't filter anything
+    def match(self, filters, mask=None):
+        if mask is None:
+            mask = rangeBitset(0, self.size)
+        for field, values in filters.items():
+            if not values:
+                continue
+            anyOf = 0
+            for value in values:
+                anyOf |= self.bitset(field, value)
+            mask &= anyOf
+            if not mask:
+                break
+        return mask
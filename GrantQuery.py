@@ -0,0 +1,129 @@
+"""
+headless queries over the cached extract, without the UI
+
+usage:
+    python GrantQuery.py START END [--eligibility CODE ...] [--category CODE ...]
+                         [--instrument CODE ...] [--cfda NUMBER ...] [--count] [--url URL]
+    e.g. python GrantQuery.py 20220101 20220131 --eligibility 00 --category ED
+
+prints every opportunity posted from START to END (YYYYMMDD, inclusive) that matches the
+filters, one JSON object per line. Giving a filter several values matches any of them, and
+every filter given has to match. Codes or their names can be used (e.g. ED or Education).
+    python GrantQuery.py --values FIELD
+lists the values of a facet in the latest extract and how many opportunities have each.
+    python GrantQuery.py START END --rollup [filters]
+counts the matching opportunities by agency and sub-agency, as the report groups them.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import sys
+from contextlib import redirect_stdout
+
+import GrantCache
+from AgencyIndex import AgencyIndex
+from GrantFacets import FACET_FIELDS, facetLabels
+
+DEFAULT_URL = "https://www.grants.gov/xml-extract"
+
+
+# returns the code for a facet value given as its code or its name (any case)
+# values that are neither are returned as they are, e.g. CFDA numbers
+def facetCode(field, value):
+    labels = facetLabels[field]
+    if value in labels:
+        return value
+    for code, label in labels.items():
+        if value.lower() in (code.lower(), label.lower()):
+            return code
+    return value
+
+
+# facet filters for Snapshot.filtered, from lists of codes or names
+def makeFilters(eligibility=(), category=(), instrument=(), cfda=()):
+    wanted = dict(zip(FACET_FIELDS, (eligibility, category, instrument, cfda)))
+    return {field: [facetCode(field, value) for value in values]
+            for field, values in wanted.items() if values}
+
+
+# opportunities posted from start to end (YYYYMMDD, inclusive) that match the filters,
+# in post date order
+def search(snapshot, start, end, filters=None):
+    return snapshot.filtered(start, end, filters)
+
+
+# the opportunities grouped by agency and sub-agency (see AgencyIndex.py)
+def agencyIndex(opportunities):
+    index = AgencyIndex()
+    for opportunity in opportunities:
+        index.add(opportunity, opportunity.get('AgencyCode') or 'N/A',
+                  opportunity.get('AgencyName', 'N/A'))
+    return index
+
+
+# (value, name, count) for every value of the facet in the snapshot, most common first
+def facetValues(snapshot, field):
+    labels = facetLabels[field]
+    values = [(value, labels.get(value, ''), snapshot.facets.count(field, value))
+              for value in snapshot.facets.values(field)]
+    return sorted(values, key=lambda v: -v[2])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find opportunities in the latest grants.gov extract.")
+    parser.add_argument("start", nargs="?", help="first post date, YYYYMMDD")
+    parser.add_argument("end", nargs="?", help="last post date, YYYYMMDD")
+    parser.add_argument("--eligibility", nargs="+", default=[],
+                        help="eligible applicant codes or names, e.g. 00")
+    parser.add_argument("--category", nargs="+", default=[],
+                        help="funding activity category codes or names, e.g. ED")
+    parser.add_argument("--instrument", nargs="+", default=[],
+                        help="funding instrument codes or names, e.g. G")
+    parser.add_argument("--cfda", nargs="+", default=[], help="CFDA numbers, e.g. 93.243")
+    parser.add_argument("--count", action="store_true",
+                        help="print how many opportunities match instead of the opportunities")
+    parser.add_argument("--rollup", action="store_true",
+                        help="count the matching opportunities by agency and sub-agency")
+    parser.add_argument("--values", choices=FACET_FIELDS,
+                        help="list the values of a facet instead of searching")
+    parser.add_argument("--url", default=DEFAULT_URL,
+                        help="URL of the XML extract page (default: %(default)s)")
+    args = parser.parse_args()
+    if args.values is None and (args.start is None or args.end is None):
+        parser.error("START and END are required unless --values is given")
+
+    # progress messages go to stderr so the output can be piped
+    with redirect_stdout(sys.stderr):
+        snapshot = GrantCache.latest(args.url)
+        print()
+
+    if args.values is not None:
+        for value, name, count in facetValues(snapshot, args.values):
+            print("{0}\t{1}\t{2}".format(value, count, name))
+    else:
+        filters = makeFilters(args.eligibility, args.category, args.instrument, args.cfda)
+        opportunities = search(snapshot, args.start, args.end, filters)
+        if args.count:
+            print(len(opportunities))
+        elif args.rollup:
+            index = agencyIndex(opportunities)
+            for agency, subAgency, count in index.rollup(lambda o: o.get('AgencyName', 'N/A')):
+                print("{0}\t{1}\t{2}".format(agency, subAgency, count))
+        else:
+            for opportunity in opportunities:
+                print(json.dumps(opportunity))
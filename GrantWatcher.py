@@ -0,0 +1,113 @@
+"""
+watch mode: polls the grants.gov XML extract page and pre-warms the cache whenever a new
+GrantsDBExtract<date>v2.zip is published, so reports never wait for the download,
+unzip and parse
+
+usage:
+    python GrantWatcher.py [--url URL] [--interval SECONDS]
+
+the new extract is downloaded and parsed in a background thread while polling carries
+on. Every request to the site waits on GrantDownloader.crawlDelay, so polling and
+downloading together never break the crawl-delay.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import threading
+import traceback
+
+import GrantCache
+import GrantDownloader
+import ReportCache
+
+DEFAULT_URL = "https://www.grants.gov/xml-extract"
+# how often to check for a new extract, grants.gov publishes one a day
+DEFAULT_INTERVAL = 60 * 60
+
+
+class Watcher:
+
+    def __init__(self, xml_dumps_url=DEFAULT_URL, interval=DEFAULT_INTERVAL,
+                 crawlDelay=GrantDownloader.crawlDelay):
+        self.xml_dumps_url = xml_dumps_url
+        # never poll faster than the crawl-delay allows
+        self.interval = max(interval, crawlDelay.delay)
+        self.crawlDelay = crawlDelay
+        self.stopped = threading.Event()
+        # latest extract that has been warmed, e.g. GrantsDBExtract20220203
+        self.warmed = None
+        self.worker = None
+
+    # downloads, unzips and parses the extract into the cache
+    def warm(self, grant_url, filename):
+        try:
+            self.crawlDelay.wait()
+            GrantCache.fetch(grant_url, filename)
+            # reports from the previous extract are out of date now
+            ReportCache.prune(filename)
+            self.warmed = filename
+            print("cache warmed for " + filename)
+        except Exception:
+            print("There was an exception while warming the cache for " + filename)
+            traceback.print_exc()
+
+    # checks the dump page once, starting a background warm if there is a new extract
+    # returns the background thread, or None if there was nothing to do
+    def poll(self):
+        if self.worker is not None and self.worker.is_alive():
+            return None
+        self.crawlDelay.wait()
+        grant_url, filename = GrantDownloader.latestExtract(self.xml_dumps_url)
+        if filename == self.warmed:
+            return None
+        if GrantCache.isWarm(filename):
+            self.warmed = filename
+            return None
+        print("new extract published ({0}), warming cache".format(filename))
+        self.worker = threading.Thread(target=self.warm, args=(grant_url, filename),
+                                       daemon=True)
+        self.worker.start()
+        return self.worker
+
+    # polls every interval until stop() is called
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                print("There was an exception while checking " + self.xml_dumps_url)
+                traceback.print_exc()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pre-warm the grants cache whenever a new extract is published.")
+    parser.add_argument("--url", default=DEFAULT_URL,
+                        help="URL of the XML extract page (default: %(default)s)")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL,
+                        help="seconds between checks, at least the crawl-delay (default: %(default)s)")
+    args = parser.parse_args()
+
+    watcher = Watcher(args.url, args.interval)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+        GrantDownloader.cleanTmp()
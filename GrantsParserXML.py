@@ -17,57 +17,23 @@ import datetime
 import html as html
 import os
 import threading
-import xml.etree.ElementTree as et
-from tkinter import (BOTTOM, LEFT, RIGHT, TOP, Button, Frame, Label, Entry, Tk,
-                     messagebox)
+from tkinter import (BOTTOM, LEFT, RIGHT, TOP, Button, Checkbutton, Frame, IntVar, Label,
+                     Entry, OptionMenu, StringVar, Tk, messagebox)
 
-import docx
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.shared import Pt
 from tkcalendar import DateEntry
 
-import GrantDownloader
-import word
-
-# dictionary of agencies using agency code as key
-# these were all the agencies in the search function for Grants.gov
-# I added 'N/A' to the list to make sure that if we did not have a match, we would still have a key for it
-agencyDictionary = {'USAID': 'Agency for International Development',
-                    'AC': 'AmeriCorps',
-                    'USDA': 'Department of Agriculture',
-                    'DOC': 'Department of Commerce',
-                    'DOE': 'Department of Energy',
-                    'DOD': 'Department of Defense',
-                    'ED': 'Department of Education',
-                    'PAMS': 'Department of Health and Human Services',
-                    'HHS': 'Department of Health and Human Services',
-                    'DHS': 'Department of Homeland Security',
-                    'HUD': 'Department of Housing and Urban Development',
-                    'USDOJ': 'Department of Justice',
-                    'DOL': 'Department of Labor',
-                    'DOS': 'Department of State',
-                    'DOI': 'Department of the Interior',
-                    'USDOT': 'Department of the Treasury',
-                    'DOT': 'Department of Transportation',
-                    'VA': 'Department of Veterans Affairs',
-                    'EPA': 'Environmental Protection Agency',
-                    'GCERC': 'Gulf Coast Ecosystem Restoration Council',
-                    'IMLS': 'Institute of Museum and Library Services',
-                    'MCC': 'Millennium Challenge Corportation',
-                    'NASA': 'National Aeronautics and Space Administration',
-                    'NARA': 'National Archives and Records Administration',
-                    'NEA': 'National Endowment for the Arts',
-                    'NEH': 'National Endowment for the Humanities',
-                    'NSF': 'National Science Foundation',
-                    'NRC': 'National Resource Conservation Council',
-                    'SBA': 'Small Business Administration',
-                    'SSA': 'Social Security Administration',
-                    'N/A': 'Other Agencies'}
-
-# String that saves the http portion of the XML tags so that we don't have to keep typing it out,
-# e.g. referencing the tag '{http://apply.grants.gov/system/OpportunityDetail-V1.0}OpportunityTitle'
-# becomes just linkString+'OpportunityTitle'
-linkString = '{http://apply.grants.gov/system/OpportunityDetail-V1.0}'
+import AgencyIndex
+import docxreport
+import GrantCache
+import GrantFacets
+import GrantQuery
+import renderers
+import ReportCache
+import template
+
+# every agency code is resolved once (parent agency, sub-agency, name) and the grants are
+# grouped by agency as they're added (see AgencyIndex.py)
+agencyIndex = AgencyIndex.AgencyIndex()
 
 # ********************************************DEF*****************************************************************
 
@@ -113,23 +79,6 @@ def dateHierarchyForm(date):
     return newDate
 
 
-# this function takes an agency code and returns the name of the agency
-def generateAgencyName(agencyCode):
-    # agency codes have dashes to separate the information.
-    if '-' in agencyCode:
-        # we only want the first part of the agency code which identifies the agency itself
-        agencyCode = agencyCode.split('-')[0]
-
-    # if the agency is in the list of agencies, we can use the agency code to get the name
-    if agencyCode in agencyDictionary:
-        agencyCode = agencyDictionary[agencyCode]   # of the agency
-
-    else:
-        # if the agency is not in the list of agencies, we will use the string 'Other Agencies'
-        agencyCode = 'Other Agencies'
-
-    return agencyCode
-
 # function to generate link to grant from grant ID
 
 
@@ -148,26 +97,13 @@ def wordLimiter(string, limit):
     string = " ".join(string) + "..."
     return string
 
-# create table of unique agencies (want to improve this, lot of redudancies related
-# to multiple instances of the same agency with additional information)
-
-
-def tableOfContents(listA, agency):
-
-    if agency in listA:                     # if the agency is already in the list, we don't need to add it again
-        return listA
-    else:
-        # if the agency is not in the list, we add it to the list
-        listA.append(agency)
-
-    return listA
-
 
 # function to return an attribute of interest from a given opportunity
+# opportunities are the field dictionaries from the parsed snapshot (see GrantCache.py)
 def getOpportunityInfo(opportunity, attribute):
     #
     # Store each text of an attribute as a string, or store as 'N/A' if none exist
-    myInfo = getattr(opportunity.find(linkString + attribute), 'text', 'N/A')
+    myInfo = opportunity.get(attribute, 'N/A')
     # at given attribute location
     return myInfo
 
@@ -179,7 +115,7 @@ class Grant:
                  totalFunding, awardCeiling, awardFloor, oppNumber, description, grantLink, contactInfo, eligApplicants='N/A'):
 
         self.agencyCode = agencyCode
-        self.distinctAgency = generateAgencyName(agencyCode)
+        self.distinctAgency = agencyIndex.resolve(agencyCode, agencyName).parent
         self.agencyName = agencyName
         self.opportunityTitle = opportunityTitle
         self.postDate = postDate
@@ -224,11 +160,6 @@ def printGrant(grant):
     print()
 
 
-# function to create a dictionary using the distinctAgency as a key and the grants as values
-def grantDictionaryAdd(grantDictionary, grant):
-    grantDictionary.setdefault(grant.distinctAgency, []).append(grant)
-    return grantDictionary
-
 # ********************************DRIVER_CODE****************************************************************************
 
 # --------------------------- UI BEGIN ---------------------------
@@ -244,7 +175,7 @@ if os.name == 'posix':
     root.iconbitmap('@resource/tux.xbm')
 else:
     root.iconbitmap('resource/icon.ico')
-root.geometry("500x320")
+root.geometry("500x640")
 
 # Sets layout of modules
 top = Frame(root)
@@ -272,30 +203,85 @@ grant_url = Entry(root, width=150)
 grant_url.insert(0, "https://www.grants.gov/xml-extract")
 grant_url.pack(side=TOP, padx=20, pady=10)
 
+# Set template selection (every "* template.docx" in the program's folder)
+templates = template.availableTemplates()
+template_label = Label(root, text="Please select a report template.")
+template_label.pack(pady=5, side=TOP)
+template_choice = StringVar(root, value=templates[0] if templates else "")
+template_menu = OptionMenu(root, template_choice, *(templates or [""]))
+template_menu.pack(side=TOP, padx=20, pady=5)
+
+# Set output format selection: file extension and writer for each format
+reportFormats = {'Word (.docx)': ('docx', docxreport.saveReport),
+                 'HTML (.html)': ('html', renderers.saveHtmlReport),
+                 'JSON (.json)': ('json', renderers.saveJsonReport),
+                 'NDJSON (.ndjson)': ('ndjson', renderers.saveNdjsonReport)}
+format_label = Label(root, text="Please select an output format.")
+format_label.pack(pady=5, side=TOP)
+format_choice = StringVar(root, value='Word (.docx)')
+format_menu = OptionMenu(root, format_choice, *reportFormats)
+format_menu.pack(side=TOP, padx=20, pady=5)
+
+# Set low-memory output option, for very large Word reports
+streaming_choice = IntVar(root, value=0)
+streaming_check = Checkbutton(root, text="Low-memory output (for very large reports)",
+                              variable=streaming_choice)
+streaming_check.pack(side=TOP, padx=20, pady=5)
+
+# Set optional filters: eligible applicants, funding category and funding instrument
+# ("Any" doesn't filter), and CFDA numbers separated by commas (blank doesn't filter)
+filter_label = Label(root, text="Optionally, only include grants matching these filters.")
+filter_label.pack(pady=5, side=TOP)
+filter_choices = {}
+for field in GrantFacets.FACET_FIELDS[:3]:
+    names = GrantFacets.facetLabels[field]
+    filter_choices[field] = StringVar(root, value="Any")
+    filter_menu = OptionMenu(root, filter_choices[field], "Any", *names.values())
+    filter_menu.config(width=50)
+    filter_menu.pack(side=TOP, padx=20, pady=2)
+cfda_label = Label(root, text="CFDA numbers (e.g. 93.243, 84.027)")
+cfda_label.pack(pady=2, side=TOP)
+cfda_entry = Entry(root, width=40)
+cfda_entry.pack(side=TOP, padx=20, pady=2)
+
 # Function for collecting date from calendar and url
 def grab_data():
-    global userdateone, userdatetwo, userurl
+    global userdateone, userdatetwo, userurl, usertemplate, userformat, userstreaming, userfilters
     userdateone = calone.get_date()
     userdatetwo = caltwo.get_date()
     userurl = grant_url.get()
-
-    if userdateone > userdatetwo or userurl == "":
+    usertemplate = template_choice.get()
+    userformat = format_choice.get()
+    userstreaming = streaming_choice.get()
+    chosen = [choice.get() for choice in filter_choices.values()]
+    userfilters = GrantQuery.makeFilters(*[[] if name == "Any" else [name] for name in chosen],
+                                         cfda=[n.strip() for n in cfda_entry.get().split(",") if n.strip()])
+
+    if userdateone > userdatetwo or userurl == "" or usertemplate == "":
         if userdateone > userdatetwo:
             messagebox.showerror(
             "Improper Date Range", "Please ensure your first date is before your second date.")
         if userurl == "":
             messagebox.showerror(
                 "Enter the URL.", "Please enter the URL.")
+        if usertemplate == "":
+            messagebox.showerror(
+                "No Template Found", "Please place a \"* template.docx\" file in the program's folder.")
     else:
         root.destroy()
 
 # Function for usage in multithreading of grantdownloader.py
+# loads the parsed snapshot of the extract, parsing it only if it isn't cached yet
 def downloadxml():
-    global mytree, userurl
-    mytree = et.parse(GrantDownloader.get(userurl))
+    global snapshot, userurl
+    snapshot = GrantCache.latest(userurl)
 
 userdateone = calone.get_date()
 userdatetwo = caltwo.get_date()
+usertemplate = template_choice.get()
+userformat = format_choice.get()
+userstreaming = streaming_choice.get()
+userfilters = {}
 
 # Button Grabs selected dates then closes if userdateone > userdatetwo
 my_button = Button(root, text="Confirm",
@@ -313,13 +299,8 @@ root.mainloop()
 dateRangeOne = userdateone.strftime("%Y%m%d")
 dateRangeTwo = userdatetwo.strftime("%Y%m%d")
 
-'''
-Trying to look into more efficient parsing, this site seems to have a better, space efficient parsing method I need to explore:
-https://newbedev.com/efficient-way-to-iterate-through-xml-elements
-'''
-
-# Parse our file and store it in a tree
-mytree = et.parse(GrantDownloader.get(userurl))
+# The extract is parsed once with iterparse into a cached snapshot (see GrantCache.py), so
+# later reports against the same extract, or a cache pre-warmed by GrantWatcher.py, skip parsing
 
 # Set what function other thread will execute
 th = threading.Thread(target=downloadxml)
@@ -337,21 +318,34 @@ th.join()
 
 ###############################################################---XML Parsing/Grant Generation---#############################################################################
 
-# Store the root element of this file
-myroot = mytree.getroot()
+#! Picks the writer for the chosen output format. For Word, low-memory mode streams document.xml
+#! into the output file instead of building it in memory first
+extension, writeReport = reportFormats[userformat]
+if userstreaming and writeReport is docxreport.saveReport:
+    writeReport = docxreport.streamReport
+reportPath = f"GrantsReport_{today}.{extension}"
+reportDate = str(datetime.date.today().strftime("%B %d, %Y"))
+
+# Finished reports are cached (see ReportCache.py), so asking for the same report again
+# (same extract, grants, template, format and date) just copies it out of the cache
+reportKey = ReportCache.reportKey(snapshot, dateRangeOne, dateRangeTwo,
+                                  usertemplate if extension == 'docx' else None, extension, reportDate,
+                                  userfilters)
+reportCached = ReportCache.restore(reportKey, reportPath)
+if reportCached:
+    print("Report found in cache")
+
+# Opportunities posted in the date range selected in UI that match the filters, found with the
+# snapshot's post date and facet indexes (none are needed if the report came from the cache)
+opportunities = [] if reportCached else snapshot.filtered(dateRangeOne, dateRangeTwo, userfilters)
 
 # Count the number of grants that we have chosen to print,
 count = 0
 
-# Declare our list to store agency names
-agencyList = []
-grantDictionary = {}
-
-# Check each grant opportunity in our tree
-for opportunity in myroot:
+# Check each grant opportunity in our date range
+for opportunity in opportunities:
 
     # Get the postdate first
-    # getattr(opportunity.find(linkString + 'PostDate'), 'text', 'N/A')
     postDate = getOpportunityInfo(opportunity, 'PostDate')
     # Set the desired earliest date
     # Finds grants of date range selected in UI
@@ -386,9 +380,8 @@ for opportunity in myroot:
             contactInfo=html.unescape(getOpportunityInfo(
                 opportunity, 'GrantorContactText'))
         )
-        tableOfContents(agencyList, grant.distinctAgency)
-        # Create a grant object
-        grantDictionary = grantDictionaryAdd(grantDictionary, grant)
+        # File the grant under its agency and sub-agency
+        agencyIndex.add(grant, grant.agencyCode, grant.agencyName)
         # printGrant(grant)
 
         # Count the selected grant
@@ -400,7 +393,8 @@ for opportunity in myroot:
 
 # # sort the list of agencies
 # print()
-agencyList.sort()
+agencyList = agencyIndex.agencyList()
+grantDictionary = agencyIndex.grantDictionary()
 
 # print the list of agencies
 # print('Table of Contents')
@@ -411,152 +405,15 @@ agencyList.sort()
 #####################################################################################################################
 #  ChangeTemplate
 
-#! Opens the word templet file. Change the string passed as an argument to the method .Document to use a different template
-# Provided templates are:
+#! Writes the report with the writer picked for the chosen output format (before the grants were
+#! gathered, so a cached report can skip them). Word reports are built from the template chosen in
+#! the UI. Templates are compiled once into a cached skeleton (see template.py), so the date, table
+#! of contents and body are found by name rather than by paragraph number. Provided templates are:
 #   Marshall template.docx
 #   OpsWatch template.docx
 
-doc = docx.Document("Marshall template.docx")
-
 #####################################################################################################################
 
-#! change text in paragraph 9 to the number of grants
-doc.paragraphs[9].text = str(datetime.date.today().strftime("%B %d, %Y"))
-
-#! Random paragraph object to position the start of the hyperlink prints
-spacerpara = doc.add_paragraph("\n")
-paragraph_format = spacerpara.paragraph_format
-paragraph_format.line_spacing = 1.0
-
-#! Add page break
-doc.add_page_break()
-
-#! Add Header to start of Grants sections
-
-line = doc.add_paragraph()
-line.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-run = line.add_run("\nGrants\n")
-run.bold = True
-font = run.font
-font.size = Pt(22)
-font.name = 'Times New Roman'
-font.underline = True
-
-#! Set pointer to equal paragraph 11
-paracount = 12
-pointer = doc.paragraphs[paracount]
-
-#! Check if it's a new agency
-agency_check = set()
-agency_name_check = set()
-
-#! This prints generates the bookmarks
-for index, agency in enumerate(agencyList):
-
-    grantDictionary[agency].sort(key=lambda x: x.dueDate)
-
-    #! Loop over each grant in the dictionary
-    grant_list = grantDictionary.get(agency)
-    for i in grant_list:
-
-        if agency not in agency_check:
-            agency_check.add(agency)
-            paragraph = doc.add_paragraph()
-            paragraph_format = paragraph.paragraph_format
-            paragraph_format.line_spacing = 1.0
-            bookmark_para = word.add_bookmark(
-                paragraph, agency, f"bookmark{str(index)}")
-
-            paragraph_format = pointer.paragraph_format
-            paragraph_format.line_spacing = 1.0
-            word.insert_paragraph_after(pointer, word.add_link(
-                pointer, f"bookmark{str(index)}", agency))
-            paracount += 1
-            pointer = doc.paragraphs[paracount]
-
-        if i.agencyName not in agency_name_check:
-            agency_name_check.add(i.agencyName)
-
-            paragraph_format = pointer.paragraph_format
-            paragraph_format.line_spacing = 1.0
-            word.insert_paragraph_after(pointer, i.agencyName)
-            paracount += 1
-            pointer = doc.paragraphs[paracount]
-
-            paragraph_format = pointer.paragraph_format
-            paragraph_format.line_spacing = 1.0
-            word.insert_paragraph_after(pointer, f"\t• {i.opportunityTitle}")
-            paracount += 1
-            pointer = doc.paragraphs[paracount]
-
-        else:
-            paragraph_format = pointer.paragraph_format
-            paragraph_format.line_spacing = 1.0
-            word.insert_paragraph_after(pointer, f"\t• {i.opportunityTitle}")
-            paracount += 1
-            pointer = doc.paragraphs[paracount]
-
-        paragraph = doc.add_paragraph()
-        paragraph_format = paragraph.paragraph_format
-        paragraph_format.line_spacing = 1.0
-
-        paragraph.add_run(f"\nAgency Name: {i.agencyName}").bold = True
-        paragraph.add_run(
-            f"\nOpportunity Title: {i.opportunityTitle}").bold = True
-        paragraph.add_run(f"\nPost Date:\t\t\t\t\t\t{i.postDate}").bold = True
-        paragraph.add_run(
-            f"\nProposal Due Date:\t\t\t\t\t{i.dueDate}").bold = True
-        paragraph.add_run(
-            f"\nExpected Number of awards:\t\t\t{i.numAwards}").bold = True
-        paragraph.add_run(
-            f"\nEstimated total program funding:\t\t{i.totalFunding}").bold = True
-        paragraph.add_run(
-            f"\nAward Ceiling:\t\t\t\t\t{i.awardCeiling}").bold = True
-        paragraph.add_run(
-            f"\nAward Floor:\t\t\t\t\t{i.awardFloor}").bold = True
-        paragraph.add_run(
-            f"\nFunding Opportunity Number:\t\t\t{i.oppNumber}").bold = True
-
-        run = paragraph.add_run(f"\n\nPurpose: ")
-        run.bold = True
-
-        run = paragraph.add_run(f"{i.description}")
-        font = run.font
-        font.size = Pt(12)
-        # font.italic = True
-        # font.name = 'Times New Roman'
-
-        # Print eligibility information
-        run = paragraph.add_run(f"\n\nEligible Applicants: ")
-        run.bold = True
-
-        run = paragraph.add_run(f"{i.eligApplicants}")
-        font = run.font
-        font.size = Pt(12)
-        #font.name = 'Times New Roman'
-        paragraph.add_run(f"\n")
-
-        # Print contact information if available
-        if (i.contactInfo != 'N/A'):
-            run = paragraph.add_run(f"\nContact: ")
-            run.bold = True
-
-            contactArr = i.contactInfo.split('<br/>')
-            for j in contactArr:
-                run = paragraph.add_run(f"\n{j}")
-
-            paragraph.add_run(f"\n")
-
-        #! Add hyperlink to grant
-        link_para = doc.add_paragraph()
-        word.add_hyperlink(link_para, f"{i.grantLink}\n", i.grantLink)
-
-    else:
-        #! Random paragraph object to position the start of the next agency name better
-        paragraph_format.line_spacing = 1.0
-        word.insert_paragraph_after(pointer, "\n")
-        paracount += 1
-        pointer = doc.paragraphs[paracount]
-        doc.add_page_break()
-
-doc.save(f"GrantsReport_{today}.docx")
+if not reportCached:
+    writeReport(reportPath, usertemplate, reportDate, agencyList, grantDictionary)
+    ReportCache.store(reportKey, reportPath)
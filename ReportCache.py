@@ -0,0 +1,162 @@
+"""
+cache of finished reports
+creates directory:
+    ./cache/reports
+
+the same report gets asked for several times a day, so every report written is kept and a
+repeat request is copied out of the cache instead of being built again. A report is looked
+up by everything that goes into it:
+    extract     : the extract the grants come from, e.g. GrantsDBExtract20220203
+    date range  : normalized to the first and last post dates actually in the range, so
+                  ranges that pick out the same grants share a report
+    template    : hash of the template file (Word reports only)
+    format      : the file extension, e.g. docx
+    report date : the date printed on the report
+    filters     : the facet filters (see GrantFacets.py)
+cached reports are named after their extract (GrantsDBExtract20220203v2.<key>.docx). Once a
+newer extract's report is stored, reports from older extracts are removed. Past that, the
+least recently used reports are removed to stay within MAX_REPORTS and MAX_REPORT_BYTES.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import traceback
+
+import GrantCache
+from CacheManager import cache, extractName
+
+# bump this whenever the report layout changes so old reports aren't served
+REPORT_CACHE_VERSION = 2
+# most reports to keep, and most bytes of them. set either to None for no limit
+MAX_REPORTS = 20
+MAX_REPORT_BYTES = 256 * 1024 ** 2
+
+# template hashes, keyed by (path, modified time, size) so an edited template is hashed again
+_template_hashes = {}
+
+
+# cache/reports directory
+def reportsDir():
+    return os.path.join(cache.cache_dir, "reports")
+
+
+# sha1 of the template file, or '' if there is no template (formats other than Word)
+def templateHash(templatePath):
+    if not templatePath:
+        return ''
+    stat = os.stat(templatePath)
+    key = (os.path.abspath(templatePath), stat.st_mtime_ns, stat.st_size)
+    digest = _template_hashes.get(key)
+    if digest is None:
+        with open(templatePath, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        _template_hashes[key] = digest
+    return digest
+
+
+# the date range (YYYYMMDD) narrowed to the first and last post dates in it, or None if
+# nothing was posted in the range
+def normalizedRange(snapshot, start, end):
+    lo, hi = snapshot.span(start, end)
+    if lo == hi:
+        return None
+    return snapshot.postKeys[lo], snapshot.postKeys[hi - 1]
+
+
+# the facet filters in a fixed order, without the ones that don't filter anything
+def normalizedFilters(filters):
+    if not filters:
+        return {}
+    return {field: sorted(set(values)) for field, values in filters.items() if values}
+
+
+# filename of the cached report, e.g. GrantsDBExtract20220203v2.0123456789abcdef.docx
+# templatePath should be None for formats that don't use the template
+def reportKey(snapshot, start, end, templatePath, extension, dateText, filters=None):
+    extract = GrantCache.extractFilename(snapshot.source)
+    identity = json.dumps([REPORT_CACHE_VERSION, extract, normalizedRange(snapshot, start, end),
+                           templateHash(templatePath), extension, dateText,
+                           normalizedFilters(filters)], sort_keys=True)
+    digest = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+    return "{0}v2.{1}.{2}".format(extract, digest, extension)
+
+
+# copies src to dst through a partial file, so dst is never seen half-written
+def _copy(src, dst):
+    part_path = "{0}.{1}.part".format(dst, os.getpid())
+    shutil.copyfile(src, part_path)
+    os.replace(part_path, dst)
+
+
+# copies the cached report to path. returns False if it isn't cached
+def restore(key, path):
+    cached = os.path.join(reportsDir(), key)
+    with cache.lock("reports"):
+        if not os.path.isfile(cached):
+            return False
+        # marks the report as just used
+        os.utime(cached)
+        _copy(cached, path)
+    return True
+
+
+# stores the report written to path under key, then prunes the cache
+def store(key, path):
+    os.makedirs(reportsDir(), exist_ok=True)
+    with cache.lock("reports"):
+        _copy(path, os.path.join(reportsDir(), key))
+        prune(extractName(key))
+
+
+# removes reports from extracts older than current, then the least recently used reports
+# until the cache is within MAX_REPORTS and MAX_REPORT_BYTES
+def prune(current=None):
+    if not os.path.isdir(reportsDir()):
+        return
+    with cache.lock("reports"):
+        reports = []
+        for filename in os.listdir(reportsDir()):
+            path = os.path.join(reportsDir(), filename)
+            extract = extractName(filename)
+            if extract is None or not os.path.isfile(path):
+                continue
+            if current is not None and extract < current:
+                _remove(path)
+                continue
+            stat = os.stat(path)
+            reports.append((stat.st_mtime, stat.st_size, path))
+        reports.sort()
+        count = len(reports)
+        total = sum(size for _, size, _ in reports)
+        for _, size, path in reports:
+            over_count = MAX_REPORTS is not None and count > MAX_REPORTS
+            over_bytes = MAX_REPORT_BYTES is not None and total > MAX_REPORT_BYTES
+            if not (over_count or over_bytes):
+                break
+            _remove(path)
+            count -= 1
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except Exception:
+        print("There was an exception while removing " + path)
+        traceback.print_exc()
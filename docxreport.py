@@ -0,0 +1,336 @@
+"""
+writes the grants report as a Word document
+two writers produce the same document:
+    saveReport   : builds the whole python-docx tree in memory, then saves it
+    streamReport : writes word/document.xml straight into the output zip, one paragraph
+                   at a time, so memory stays bounded no matter how many grants there are
+
+streamReport makes two passes over the grouped grants: the first writes the table of
+contents, the second writes the grant blocks and their bookmarks. Everything else in the
+document (header, footer, styles, images) is copied from the compiled template.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import io
+import re
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+from docx.enum.text import WD_BREAK
+from docx.opc.constants import RELATIONSHIP_TYPE
+from docx.oxml import OxmlElement
+from docx.shared import Pt
+from docx.text.paragraph import Paragraph
+from lxml import etree
+
+import AgencyIndex
+import template
+import word
+
+# comments left in the skeleton's document.xml to mark where streamed paragraphs go
+TOC_MARK = "grantParse-toc"
+BODY_MARK = "grantParse-body"
+
+DOCUMENT_XML = "word/document.xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+
+# matches a single XML tag. Text nodes never contain a bare "<", so this never matches text
+_tag = re.compile(r"<[^<>]*>")
+_nsdecl = re.compile(r' xmlns:(\w+)="([^"]*)"')
+# characters escaped in attribute values, on top of &, < and >, the same way lxml does
+_attribute_entities = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+# writes the details of a single grant into the given paragraph
+def addGrantDetails(paragraph, grant):
+    paragraph_format = paragraph.paragraph_format
+    paragraph_format.line_spacing = 1.0
+
+    paragraph.add_run(f"\nAgency Name: {grant.agencyName}").bold = True
+    paragraph.add_run(
+        f"\nOpportunity Title: {grant.opportunityTitle}").bold = True
+    paragraph.add_run(f"\nPost Date:\t\t\t\t\t\t{grant.postDate}").bold = True
+    paragraph.add_run(
+        f"\nProposal Due Date:\t\t\t\t\t{grant.dueDate}").bold = True
+    paragraph.add_run(
+        f"\nExpected Number of awards:\t\t\t{grant.numAwards}").bold = True
+    paragraph.add_run(
+        f"\nEstimated total program funding:\t\t{grant.totalFunding}").bold = True
+    paragraph.add_run(
+        f"\nAward Ceiling:\t\t\t\t\t{grant.awardCeiling}").bold = True
+    paragraph.add_run(
+        f"\nAward Floor:\t\t\t\t\t{grant.awardFloor}").bold = True
+    paragraph.add_run(
+        f"\nFunding Opportunity Number:\t\t\t{grant.oppNumber}").bold = True
+
+    run = paragraph.add_run(f"\n\nPurpose: ")
+    run.bold = True
+
+    run = paragraph.add_run(f"{grant.description}")
+    font = run.font
+    font.size = Pt(12)
+    # font.italic = True
+    # font.name = 'Times New Roman'
+
+    # Print eligibility information
+    run = paragraph.add_run(f"\n\nEligible Applicants: ")
+    run.bold = True
+
+    run = paragraph.add_run(f"{grant.eligApplicants}")
+    font = run.font
+    font.size = Pt(12)
+    #font.name = 'Times New Roman'
+    paragraph.add_run(f"\n")
+
+    # Print contact information if available
+    if (grant.contactInfo != 'N/A'):
+        run = paragraph.add_run(f"\nContact: ")
+        run.bold = True
+
+        contactArr = grant.contactInfo.split('<br/>')
+        for j in contactArr:
+            run = paragraph.add_run(f"\n{j}")
+
+        paragraph.add_run(f"\n")
+
+
+# builds the report in memory with python-docx and saves it to path
+def saveReport(path, templatePath, dateText, agencyList, grantDictionary):
+    report = template.newReport(templatePath)
+    doc = report.doc
+
+    #! change the date paragraph to the report date
+    report.date.text = dateText
+
+    #! Table of contents entries are inserted after this pointer
+    pointer = report.toc
+
+    #! Grant blocks are inserted after the "Grants" header, each after the last
+    body = report.body
+
+    #! This prints generates the bookmarks
+    for index, agency in enumerate(agencyList):
+
+        grantDictionary[agency].sort(key=lambda x: x.dueDate)
+        grant_list = grantDictionary.get(agency)
+
+        if grant_list:
+            paragraph = body = word.insert_paragraph_after(body)
+            paragraph_format = paragraph.paragraph_format
+            paragraph_format.line_spacing = 1.0
+            word.add_bookmark(paragraph, agency, f"bookmark{str(index)}")
+
+            paragraph_format = pointer.paragraph_format
+            paragraph_format.line_spacing = 1.0
+            word.add_link(pointer, f"bookmark{str(index)}", agency)
+            pointer = word.insert_paragraph_after(pointer)
+
+        #! Table of contents lists each sub-agency once, with all of its grants under it
+        for agency_name, sub_grants in AgencyIndex.bySubAgency(grant_list).items():
+            paragraph_format = pointer.paragraph_format
+            paragraph_format.line_spacing = 1.0
+            pointer = word.insert_paragraph_after(pointer, agency_name)
+
+            for i in sub_grants:
+                paragraph_format = pointer.paragraph_format
+                paragraph_format.line_spacing = 1.0
+                pointer = word.insert_paragraph_after(
+                    pointer, f"\t• {i.opportunityTitle}")
+
+        #! Loop over each grant in the dictionary
+        for i in grant_list:
+            body = word.insert_paragraph_after(body)
+            addGrantDetails(body, i)
+
+            #! Add hyperlink to grant
+            link_para = body = word.insert_paragraph_after(body)
+            word.add_hyperlink(link_para, f"{i.grantLink}\n", i.grantLink)
+
+        #! Random paragraph object to position the start of the next agency name better
+        pointer = word.insert_paragraph_after(pointer, "\n")
+        body = word.insert_paragraph_after(body)
+        body.add_run().add_break(WD_BREAK.PAGE)
+
+    doc.save(path)
+
+
+# writes finished paragraphs into an open document.xml stream
+class _ParagraphWriter:
+
+    def __init__(self, stream, parent, nsmap):
+        self.stream = stream
+        self.parent = parent
+        # paragraphs are created with every namespace <w:document> declares, so elements
+        # appended to them (e.g. a hyperlink's r:id) pick up the document's prefixes
+        self.nsmap = {prefix: uri for prefix, uri in nsmap.items() if prefix}
+        # those declarations are already made on <w:document>, so they're dropped from
+        # each paragraph instead of being repeated thousands of times
+        self.declared = set(self.nsmap.items())
+
+    def _undeclare(self, match):
+        return _nsdecl.sub(
+            lambda ns: "" if ns.groups() in self.declared else ns.group(0),
+            match.group(0))
+
+    def new(self, text=None):
+        paragraph = Paragraph(OxmlElement("w:p", nsdecls=self.nsmap), self.parent)
+        if text:
+            paragraph.add_run(text)
+        return paragraph
+
+    def write(self, paragraph):
+        xml = etree.tostring(paragraph._p, encoding="unicode")
+        self.stream.write(_tag.sub(self._undeclare, xml).encode("utf-8"))
+
+
+# hands out relationship ids for external hyperlinks the same way python-docx does
+# (lowest unused rIdN, and the same id again for a url that's already related), and spools
+# the relationships to disk until document.xml is done
+class _HyperlinkRels:
+
+    def __init__(self, used, spool):
+        self.used = set(used)
+        self.spool = spool
+        self.next = 1
+        # url -> its relationship id
+        self.ids = {}
+
+    def add(self, url):
+        r_id = self.ids.get(url)
+        if r_id is not None:
+            return r_id
+        while f"rId{self.next}" in self.used:
+            self.next += 1
+        r_id = f"rId{self.next}"
+        self.used.add(r_id)
+        self.ids[url] = r_id
+        self.spool.write(
+            '<Relationship Id="{0}" Type="{1}" Target="{2}" TargetMode="External"/>'.format(
+                r_id, RELATIONSHIP_TYPE.HYPERLINK, escape(url, _attribute_entities)).encode("utf-8"))
+        return r_id
+
+
+# writes the table of contents, following the same pointer steps as saveReport
+def _streamTableOfContents(writer, pointer, agencyList, grantDictionary):
+    for index, agency in enumerate(agencyList):
+
+        grantDictionary[agency].sort(key=lambda x: x.dueDate)
+        grant_list = grantDictionary.get(agency)
+
+        if grant_list:
+            pointer.paragraph_format.line_spacing = 1.0
+            word.add_link(pointer, f"bookmark{str(index)}", agency)
+            writer.write(pointer)
+            pointer = writer.new()
+
+        for agency_name, sub_grants in AgencyIndex.bySubAgency(grant_list).items():
+            pointer.paragraph_format.line_spacing = 1.0
+            writer.write(pointer)
+            pointer = writer.new(agency_name)
+
+            for i in sub_grants:
+                pointer.paragraph_format.line_spacing = 1.0
+                writer.write(pointer)
+                pointer = writer.new(f"\t• {i.opportunityTitle}")
+
+        writer.write(pointer)
+        pointer = writer.new("\n")
+
+    writer.write(pointer)
+
+
+# writes the grant blocks, one agency (bookmark, grants, page break) at a time
+def _streamGrants(writer, rels, agencyList, grantDictionary):
+    for index, agency in enumerate(agencyList):
+
+        grant_list = grantDictionary.get(agency)
+        if grant_list:
+            paragraph = writer.new()
+            paragraph.paragraph_format.line_spacing = 1.0
+            word.add_bookmark(paragraph, agency, f"bookmark{str(index)}")
+            writer.write(paragraph)
+
+        for i in grant_list:
+            paragraph = writer.new()
+            addGrantDetails(paragraph, i)
+            writer.write(paragraph)
+
+            #! Add hyperlink to grant
+            link_para = writer.new()
+            word.add_hyperlink(link_para, f"{i.grantLink}\n", i.grantLink,
+                               r_id=rels.add(i.grantLink))
+            writer.write(link_para)
+
+        page_break = writer.new()
+        page_break.add_run().add_break(WD_BREAK.PAGE)
+        writer.write(page_break)
+
+
+# writes the same report as saveReport without keeping the document tree in memory
+def streamReport(path, templatePath, dateText, agencyList, grantDictionary):
+    report = template.newReport(templatePath)
+    doc = report.doc
+    report.date.text = dateText
+
+    # take the table of contents pointer out of the skeleton, it's streamed with the
+    # rest of the table of contents, and mark where the two streamed sections go
+    body = doc.element.body
+    pointer = report.toc
+    pointer._p.addprevious(etree.Comment(TOC_MARK))
+    body.remove(pointer._p)
+    report.body._p.addnext(etree.Comment(BODY_MARK))
+    nsmap = doc.element.nsmap
+
+    skeleton = io.BytesIO()
+    doc.save(skeleton)
+    # the skeleton's python-docx objects aren't needed past this point
+    del report, doc, body
+
+    with zipfile.ZipFile(skeleton) as src, \
+            zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as out, \
+            tempfile.TemporaryFile() as spool:
+
+        document = src.read(DOCUMENT_XML)
+        head, rest = document.split(f"<!--{TOC_MARK}-->".encode("utf-8"))
+        middle, tail = rest.split(f"<!--{BODY_MARK}-->".encode("utf-8"))
+
+        rels_xml = src.read(DOCUMENT_RELS)
+        rels_head, rels_tail = rels_xml.rsplit(b"</Relationships>", 1)
+        used = re.findall(rb'Id="([^"]+)"', rels_xml)
+        rels = _HyperlinkRels((r_id.decode("utf-8") for r_id in used), spool)
+
+        for name in src.namelist():
+            if name not in (DOCUMENT_XML, DOCUMENT_RELS):
+                out.writestr(src.getinfo(name), src.read(name))
+
+        with out.open(DOCUMENT_XML, "w") as stream:
+            writer = _ParagraphWriter(stream, pointer._parent, nsmap)
+            stream.write(head)
+            _streamTableOfContents(writer, pointer, agencyList, grantDictionary)
+            stream.write(middle)
+            _streamGrants(writer, rels, agencyList, grantDictionary)
+            stream.write(tail)
+
+        with out.open(DOCUMENT_RELS, "w") as stream:
+            stream.write(rels_head)
+            spool.seek(0)
+            while True:
+                chunk = spool.read(1 << 16)
+                if not chunk:
+                    break
+                stream.write(chunk)
+            stream.write(b"</Relationships>" + rels_tail)
@@ -0,0 +1,161 @@
+"""
+renders the grants report as HTML, JSON or NDJSON from the same grouped grants the
+Word report uses (agencyList + grantDictionary)
+
+each renderer is a generator of string chunks, so a report is written out as it's built
+and never held in memory as one big string. The save* functions take the same arguments
+as docxreport.saveReport so the driver can pick a writer by output format.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+from html import escape
+
+import AgencyIndex
+
+# Grant attributes written to the JSON and NDJSON reports, in order
+GRANT_FIELDS = ('agencyCode', 'distinctAgency', 'agencyName', 'opportunityTitle', 'postDate',
+                'dueDate', 'numAwards', 'totalFunding', 'awardCeiling', 'awardFloor', 'oppNumber',
+                'description', 'eligApplicants', 'contactInfo', 'grantLink')
+
+# labels for the grant details, same wording as the Word report
+DETAIL_LABELS = (('agencyName', 'Agency Name'),
+                 ('opportunityTitle', 'Opportunity Title'),
+                 ('postDate', 'Post Date'),
+                 ('dueDate', 'Proposal Due Date'),
+                 ('numAwards', 'Expected Number of awards'),
+                 ('totalFunding', 'Estimated total program funding'),
+                 ('awardCeiling', 'Award Ceiling'),
+                 ('awardFloor', 'Award Floor'),
+                 ('oppNumber', 'Funding Opportunity Number'))
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Weekly Grant Opportunities Update - {date}</title>
+<style>
+body {{ font-family: Calibri, sans-serif; max-width: 60em; margin: auto; }}
+h1, h2 {{ text-align: center; }}
+.toc p {{ margin: 0; }}
+.toc .title {{ padding-left: 2em; }}
+.grant {{ margin-bottom: 2em; }}
+.grant dt {{ font-weight: bold; float: left; clear: left; width: 18em; }}
+.grant dd {{ margin-left: 18em; }}
+</style>
+</head>
+<body>
+<h1>Weekly Grant Opportunities Update</h1>
+<p>{date}</p>
+<h3>Table of Contents:</h3>
+<div class="toc">
+"""
+
+
+# anchor name for the agency at the given index, matches the Word report's bookmarks
+def anchorName(index):
+    return f"bookmark{str(index)}"
+
+
+# sorts each agency's grants the same way the Word report does, then yields
+# (index, agency, grants) for every agency in table of contents order
+def groupedGrants(agencyList, grantDictionary):
+    for index, agency in enumerate(agencyList):
+        grantDictionary[agency].sort(key=lambda x: x.dueDate)
+        yield index, agency, grantDictionary[agency]
+
+
+# escapes any value for HTML, the same text the Word report would show for it
+# (fields that were empty in the extract are None)
+def _html(value):
+    return escape(str(value))
+
+
+# returns the grant as a dictionary of GRANT_FIELDS
+def grantRecord(grant):
+    return {field: getattr(grant, field) for field in GRANT_FIELDS}
+
+
+def renderHtml(dateText, agencyList, grantDictionary):
+    yield HTML_HEAD.format(date=_html(dateText))
+
+    # table of contents, each sub-agency is listed once under its agency with all its grants
+    for index, agency, grant_list in groupedGrants(agencyList, grantDictionary):
+        yield f'<p><a href="#{anchorName(index)}">{_html(agency)}</a></p>\n'
+        for agency_name, sub_grants in AgencyIndex.bySubAgency(grant_list).items():
+            yield f'<p>{_html(agency_name)}</p>\n'
+            for i in sub_grants:
+                yield f'<p class="title">&bull; {_html(i.opportunityTitle)}</p>\n'
+        yield '<br>\n'
+    yield '</div>\n<h1>Grants</h1>\n'
+
+    for index, agency, grant_list in groupedGrants(agencyList, grantDictionary):
+        yield f'<h2 id="{anchorName(index)}">{_html(agency)}</h2>\n'
+        for i in grant_list:
+            chunk = ['<div class="grant">\n<dl>\n']
+            for field, label in DETAIL_LABELS:
+                chunk.append(
+                    f'<dt>{label}:</dt><dd>{_html(getattr(i, field))}</dd>\n')
+            chunk.append('</dl>\n')
+            chunk.append(f'<p><b>Purpose:</b> {_html(i.description)}</p>\n')
+            chunk.append(
+                f'<p><b>Eligible Applicants:</b> {_html(i.eligApplicants)}</p>\n')
+            # Print contact information if available
+            if (i.contactInfo != 'N/A'):
+                contact = '<br>'.join(escape(j) for j in str(i.contactInfo).split('<br/>'))
+                chunk.append(f'<p><b>Contact:</b><br>{contact}</p>\n')
+            link = _html(i.grantLink)
+            chunk.append(f'<p><a href="{link}">{link}</a></p>\n</div>\n')
+            yield ''.join(chunk)
+
+    yield '</body>\n</html>\n'
+
+
+def renderJson(dateText, agencyList, grantDictionary):
+    count = sum(len(grantDictionary[agency]) for agency in agencyList)
+    yield '{{"date": {0}, "count": {1}, "agencies": ['.format(json.dumps(dateText), count)
+    for index, agency, grant_list in groupedGrants(agencyList, grantDictionary):
+        yield '{0}{{"agency": {1}, "anchor": {2}, "grants": ['.format(
+            ', ' if index else '', json.dumps(agency), json.dumps(anchorName(index)))
+        for n, i in enumerate(grant_list):
+            yield (', ' if n else '') + json.dumps(grantRecord(i))
+        yield ']}'
+    yield ']}\n'
+
+
+# one grant per line, each already carrying its agency (distinctAgency)
+def renderNdjson(dateText, agencyList, grantDictionary):
+    for _, _, grant_list in groupedGrants(agencyList, grantDictionary):
+        for i in grant_list:
+            yield json.dumps(grantRecord(i)) + '\n'
+
+
+def _save(path, chunks):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(chunks)
+
+
+# the save functions take templatePath to match docxreport, the template only applies to Word
+def saveHtmlReport(path, templatePath, dateText, agencyList, grantDictionary):
+    _save(path, renderHtml(dateText, agencyList, grantDictionary))
+
+
+def saveJsonReport(path, templatePath, dateText, agencyList, grantDictionary):
+    _save(path, renderJson(dateText, agencyList, grantDictionary))
+
+
+def saveNdjsonReport(path, templatePath, dateText, agencyList, grantDictionary):
+    _save(path, renderNdjson(dateText, agencyList, grantDictionary))
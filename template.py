@@ -0,0 +1,209 @@
+"""
+compiles report templates (the provided *template.docx files) into skeletons
+creates directory:
+    ./cache/templates
+
+a compiled skeleton already contains the spacer, page break and "Grants" header that
+every report adds, and remembers three named anchors:
+    date : paragraph that receives the report date
+    toc  : paragraph after which table of contents entries are inserted
+    body : "Grants" header, grant blocks are inserted after it
+the skeleton is saved to cache/templates/ as a .docx, with its anchors next to it in a .json,
+both named after the template and the hash of its contents. Later runs open the saved
+skeleton instead of the template, so they skip finding the anchors and building the
+preamble. Every report still opens the skeleton's .docx once (python-docx has to parse it
+to build the document), so that part of the setup costs the same as opening the template.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import glob
+import json
+import os
+import re
+
+import docx
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.shared import Pt
+from docx.text.paragraph import Paragraph
+
+import ReportCache
+from CacheManager import cache
+
+# the templates ship with a ", 2021" placeholder where the date goes
+DATE_PLACEHOLDER = re.compile(r"^\s*,\s*\d{4}\s*$")
+# heading that the table of contents is listed under
+TOC_HEADING = "Table of Contents"
+
+# bump this whenever _compile changes so skeletons saved by older versions are rebuilt
+TEMPLATE_CACHE_VERSION = 1
+
+# compiled templates, keyed by (absolute path, modified time, size) so an edited
+# template is recompiled the next time it's asked for
+_compiled = {}
+
+
+# cache/templates directory
+def templatesDir():
+    return os.path.join(cache.cache_dir, "templates")
+
+
+# path of the saved skeleton, e.g. cache/templates/Marshall template.<sha1>.1.docx
+# its anchors are saved next to it, with a .json extension
+def compiledPath(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(templatesDir(), "{0}.{1}.{2}.docx".format(
+        name, ReportCache.templateHash(path), TEMPLATE_CACHE_VERSION))
+
+
+# lists the templates provided in the given directory, e.g. "Marshall template.docx"
+def availableTemplates(directory="."):
+    return sorted(os.path.basename(f)
+                  for f in glob.glob(os.path.join(directory, "* template.docx")))
+
+
+# a single report's document plus its resolved anchor paragraphs
+class Report:
+
+    def __init__(self, doc, date, toc, body):
+        self.doc = doc
+        self.date = date
+        self.toc = toc
+        self.body = body
+
+
+class ReportTemplate:
+
+    # loads the saved skeleton's anchors, or compiles the template and saves the skeleton
+    # if it hasn't been compiled yet
+    def __init__(self, path):
+        self.path = path
+        self.compiledPath = compiledPath(path)
+        self.anchorsPath = os.path.splitext(self.compiledPath)[0] + ".json"
+        # skeleton compiled in this run, handed to the first report instead of re-opening it
+        self.fresh = None
+        self.anchors = self._load()
+        if self.anchors is None:
+            self.fresh = docx.Document(path)
+            self.anchors = self._compile(self.fresh)
+            self._save(self.fresh)
+
+    # anchors of the saved skeleton, or None if it hasn't been saved
+    def _load(self):
+        if not os.path.isfile(self.compiledPath):
+            return None
+        try:
+            with open(self.anchorsPath) as f:
+                return json.load(f)
+        except Exception:
+            print("could not read compiled template " + self.anchorsPath + ", recompiling")
+            return None
+
+    # saves the skeleton and its anchors to cache/templates/, replacing skeletons compiled
+    # from older versions of the same template. The .docx is written last, so a skeleton
+    # is only found once its anchors are there
+    def _save(self, skeleton):
+        directory = templatesDir()
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        for f in glob.glob(os.path.join(glob.escape(directory), glob.escape(name) + ".*")):
+            # another run may be saving its own skeleton
+            if f.endswith(".tmp"):
+                continue
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+        tmp_path = "{0}.{1}.tmp".format(self.anchorsPath, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.anchors, f)
+        os.replace(tmp_path, self.anchorsPath)
+
+        tmp_path = "{0}.{1}.tmp".format(self.compiledPath, os.getpid())
+        skeleton.save(tmp_path)
+        os.replace(tmp_path, self.compiledPath)
+
+    # finds the date/table of contents paragraphs and builds the fixed report preamble
+    # returns the anchors as indices into the body so they can be found in a re-opened copy
+    def _compile(self, doc):
+        paragraphs = doc.paragraphs
+
+        toc_index = None
+        for index, para in enumerate(paragraphs):
+            if para.text.strip().startswith(TOC_HEADING):
+                toc_index = index
+                break
+        if toc_index is None:
+            raise ValueError(
+                "{0} has no '{1}' paragraph".format(self.path, TOC_HEADING))
+
+        date_para = None
+        for para in paragraphs[:toc_index]:
+            if DATE_PLACEHOLDER.match(para.text):
+                date_para = para
+                break
+        if date_para is None:
+            raise ValueError(
+                "{0} has no date placeholder before the table of contents".format(self.path))
+
+        #! Random paragraph object to position the start of the hyperlink prints
+        spacerpara = doc.add_paragraph("\n")
+        spacerpara.paragraph_format.line_spacing = 1.0
+
+        #! Add page break
+        doc.add_page_break()
+
+        #! Add Header to start of Grants sections
+        line = doc.add_paragraph()
+        line.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        run = line.add_run("\nGrants\n")
+        run.bold = True
+        font = run.font
+        font.size = Pt(22)
+        font.name = 'Times New Roman'
+        font.underline = True
+
+        body = list(doc.element.body)
+        return {'date': body.index(date_para._p),
+                'toc': body.index(spacerpara._p),
+                'body': body.index(line._p)}
+
+    # returns a fresh Report opened from the saved skeleton
+    def newReport(self):
+        doc, self.fresh = self.fresh, None
+        if doc is None:
+            doc = docx.Document(self.compiledPath)
+        body = doc.element.body
+        anchors = {name: Paragraph(body[index], doc._body)
+                   for name, index in self.anchors.items()}
+        return Report(doc, **anchors)
+
+
+# returns the compiled template for the given path, compiling it only if it
+# hasn't been seen yet or has changed on disk
+def compileTemplate(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    template = _compiled.get(key)
+    if template is None:
+        template = ReportTemplate(path)
+        _compiled[key] = template
+    return template
+
+
+# shortcut for compileTemplate(path).newReport()
+def newReport(path):
+    return compileTemplate(path).newReport()
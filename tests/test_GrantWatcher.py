@@ -0,0 +1,140 @@
+"""
+checks watch mode against a local stand-in for the grants.gov XML extract page
+
+run from the program's folder with:
+    python -m unittest discover tests
+a temporary folder plays the part of grants.gov (a listing page plus one extract zip) and
+is served with http.server, so no requests go to the real site. The cache is written to
+another temporary folder.
+
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import functools
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GrantCache
+import GrantDownloader
+from CacheManager import cache
+from GrantWatcher import Watcher
+
+FILENAME = "GrantsDBExtract20220203"
+
+LISTING = """<html><body>
+<table class="usa-table">
+<tr><td><a href="extract/{0}v2.zip">{0}v2.zip</a></td></tr>
+</table>
+</body></html>
+""".format(FILENAME)
+
+EXTRACT = """<?xml version="1.0" encoding="UTF-8"?>
+<Grants xmlns="http://apply.grants.gov/system/OpportunityDetail-V1.0">
+<OpportunitySynopsisDetail_1_0>
+<OpportunityID>1</OpportunityID>
+<OpportunityTitle>Stand-in opportunity</OpportunityTitle>
+<AgencyCode>HHS-NIH11</AgencyCode>
+<AgencyName>National Institutes of Health</AgencyName>
+<PostDate>02012022</PostDate>
+<CloseDate>03012022</CloseDate>
+</OpportunitySynopsisDetail_1_0>
+</Grants>
+"""
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = tempfile.TemporaryDirectory()
+        self.program = tempfile.TemporaryDirectory()
+
+        # the stand-in site: the listing page and the extract it links to
+        with open(os.path.join(self.site.name, "xml-extract"), "w") as f:
+            f.write(LISTING)
+        os.makedirs(os.path.join(self.site.name, "extract"))
+        zip_path = os.path.join(self.site.name, "extract", FILENAME + "v2.zip")
+        with zipfile.ZipFile(zip_path, "w") as data:
+            data.writestr(FILENAME + "v2.xml", EXTRACT)
+
+        handler = functools.partial(_QuietHandler, directory=self.site.name)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{0}/xml-extract".format(self.server.server_port)
+
+        # point the cache at the temporary program folder
+        self.saved = GrantDownloader.cwd, cache.cache_dir
+        GrantDownloader.cwd = self.program.name
+        cache.cache_dir = os.path.join(self.program.name, "cache")
+
+    def tearDown(self):
+        GrantDownloader.cwd, cache.cache_dir = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+        self.site.cleanup()
+        self.program.cleanup()
+
+    def testPollWarmsNewExtract(self):
+        watcher = Watcher(self.url, 0, GrantDownloader.CrawlDelay(0.2))
+        worker = watcher.poll()
+        self.assertIsNotNone(worker)
+        worker.join(30)
+
+        self.assertEqual(watcher.warmed, FILENAME)
+        self.assertTrue(GrantCache.isWarm(FILENAME))
+        snapshot = GrantCache.snapshot(GrantCache.snapshotPath(FILENAME))
+        self.assertEqual(len(snapshot.postedBetween("20220201", "20220201")), 1)
+
+        # nothing new is published, so the next poll does nothing
+        self.assertIsNone(watcher.poll())
+
+    def testPollSkipsWarmExtract(self):
+        Watcher(self.url, 0, GrantDownloader.CrawlDelay(0.2)).poll().join(30)
+
+        # a fresh watcher finds the extract already in the cache and doesn't warm it again
+        watcher = Watcher(self.url, 0, GrantDownloader.CrawlDelay(0.2))
+        self.assertIsNone(watcher.poll())
+        self.assertEqual(watcher.warmed, FILENAME)
+
+    def testPollRebuildsOldSnapshot(self):
+        # a snapshot left over from an older SNAPSHOT_VERSION
+        path = GrantCache.snapshotPath(FILENAME)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            pickle.dump((GrantCache.SNAPSHOT_VERSION - 1, FILENAME + "v2.xml", [], [], None), f)
+        self.assertFalse(GrantCache.isWarm(FILENAME))
+
+        watcher = Watcher(self.url, 0, GrantDownloader.CrawlDelay(0.2))
+        worker = watcher.poll()
+        self.assertIsNotNone(worker)
+        worker.join(30)
+        self.assertTrue(GrantCache.isWarm(FILENAME))
+
+
+if __name__ == "__main__":
+    unittest.main()
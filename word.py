@@ -68,11 +68,13 @@ def add_link(paragraph, link_to, text, tool_tip=None):
     r.font.underline = True
 
 
-def add_hyperlink(paragraph, text, url):
+def add_hyperlink(paragraph, text, url, r_id=None):
     # This gets access to the document.xml.rels file and gets a new relation id value
-    part = paragraph.part
-    r_id = part.relate_to(
-        url, docx.opc.constants.RELATIONSHIP_TYPE.HYPERLINK, is_external=True)
+    # (unless the caller manages relationships itself and already has one)
+    if r_id is None:
+        part = paragraph.part
+        r_id = part.relate_to(
+            url, docx.opc.constants.RELATIONSHIP_TYPE.HYPERLINK, is_external=True)
 
     # Create the w:hyperlink tag and add needed values
     hyperlink = docx.oxml.shared.OxmlElement('w:hyperlink')